@@ -0,0 +1,323 @@
+"""
+AlistStrm 离线性能基准
+
+在本地子进程中启动一个模拟的 Alist 服务，实现 /api/auth/login、/api/fs/list、/api/fs/search、
+/api/admin/index/progress 与 /d/ 下载，目录结构、接口延迟、错误率与分页上限均可配置。
+每轮在独立子进程中端到端运行 AlistStrm.generate_strm，统计接口调用次数、耗时、峰值内存与本轮写入文件数，
+便于对比遍历相关改动前后的性能。
+
+需要 MoviePilot 源码目录提供 app 包，例如：
+    python benchmarks/aliststrm_bench.py --moviepilot /path/to/MoviePilot --depth 4 --fanout 6 --latency 20
+    python benchmarks/aliststrm_bench.py --moviepilot /path/to/MoviePilot --mode warm --runs 5 --json
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+PLUGIN_FILE = Path(__file__).resolve().parent.parent / "plugins" / "aliststrm" / "__init__.py"
+TOKEN = "benchmark-token"
+MODIFIED = "2024-01-01T00:00:00Z"
+
+
+class FakeAlist:
+    """
+    按参数确定性生成的目录树，目录名 dir_N，视频 video_N.mkv，字幕 video_N.srt
+    """
+
+    def __init__(self, depth: int, fanout: int, files: int, subtitles: int):
+        self.depth = depth
+        self.fanout = fanout
+        self.files = files
+        self.subtitles = subtitles
+
+    def list(self, path: str):
+        parts = [part for part in path.split("/") if part]
+        if len(parts) > self.depth or any(not part.startswith("dir_") for part in parts):
+            return None
+        items = []
+        if len(parts) < self.depth:
+            items += [{"name": f"dir_{i}", "is_dir": True, "size": 0, "modified": MODIFIED}
+                      for i in range(self.fanout)]
+        items += [{"name": f"video_{i}.mkv", "is_dir": False, "size": 1 << 30, "modified": MODIFIED}
+                  for i in range(self.files)]
+        items += [{"name": f"video_{i}.srt", "is_dir": False, "size": len(self.subtitle(path)),
+                   "modified": MODIFIED} for i in range(self.subtitles)]
+        return items
+
+    def walk(self, path: str):
+        for item in self.list(path) or []:
+            if item["is_dir"]:
+                yield from self.walk(path.rstrip("/") + "/" + item["name"])
+            else:
+                yield path, item
+
+    @staticmethod
+    def subtitle(path: str) -> bytes:
+        return f"1\n00:00:01,000 --> 00:00:02,000\n{path}\n".encode()
+
+
+def serve(args, port_queue):
+    """
+    模拟Alist服务进程
+    """
+    tree = FakeAlist(args.depth, args.fanout, args.files, args.subtitles)
+    calls = Counter()
+    lock = threading.Lock()
+    rng = random.Random(args.seed)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *_):
+            pass
+
+        def count(self, name: str):
+            with lock:
+                calls[name] += 1
+
+        def reply(self, status: int, body: bytes, content_type: str = "application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def reply_json(self, data: dict):
+            self.reply(200, json.dumps(data, ensure_ascii=False).encode())
+
+        def inject(self) -> bool:
+            """
+            模拟延迟与限流/服务端错误
+            """
+            if args.latency:
+                time.sleep(args.latency / 1000)
+            with lock:
+                failed = rng.random() < args.error_rate
+            if failed:
+                self.count("errors")
+                self.reply(rng.choice((429, 502, 503)), b"busy", "text/plain")
+            return failed
+
+        def paginate(self, items: list, body: dict) -> list:
+            per_page = body.get("per_page") or 0
+            if args.server_max_page and (not per_page or per_page > args.server_max_page):
+                per_page = args.server_max_page
+            if not per_page:
+                return items
+            page = max(body.get("page") or 1, 1)
+            return items[(page - 1) * per_page: page * per_page]
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/__stats":
+                with lock:
+                    return self.reply_json(dict(calls))
+            if path == "/api/admin/index/progress":
+                self.count("index_progress")
+                return self.reply_json({"code": 200, "data": {
+                    "is_done": True, "error": "", "obj_count": 0,
+                    "last_done_time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}})
+            if path.startswith("/d/"):
+                self.count("download")
+                return self.reply(200, tree.subtitle(posixpath_dirname(unquote(path[2:]))), "text/plain")
+            self.reply(404, b"not found", "text/plain")
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            path = urlparse(self.path).path
+            if path == "/__reset":
+                with lock:
+                    calls.clear()
+                return self.reply_json({})
+            if path == "/api/auth/login":
+                self.count("login")
+                return self.reply_json({"code": 200, "message": "success", "data": {"token": TOKEN}})
+            if path not in ("/api/fs/list", "/api/fs/search"):
+                return self.reply(404, b"not found", "text/plain")
+            self.count(path.rsplit("/", 1)[-1])
+            if self.inject():
+                return
+            if self.headers.get("Authorization") != TOKEN:
+                return self.reply_json({"code": 401, "message": "token is invalidated", "data": None})
+            if path == "/api/fs/list":
+                items = tree.list(body.get("path") or "/")
+                if items is None:
+                    return self.reply_json({"code": 500, "message": "object not found", "data": None})
+            else:
+                keywords = body.get("keywords") or ""
+                items = [dict(item, parent=parent) for parent, item in tree.walk(body.get("parent") or "/")
+                         if keywords in item["name"]]
+            self.reply_json({"code": 200, "message": "success",
+                             "data": {"content": self.paginate(items, body), "total": len(items)}})
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def posixpath_dirname(path: str) -> str:
+    return path.rsplit("/", 1)[0] or "/"
+
+
+def request(base_url: str, path: str, method: str = "GET") -> dict:
+    from urllib.request import Request, urlopen
+    with urlopen(Request(base_url + path, data=b"{}" if method == "POST" else None, method=method)) as response:
+        return json.loads(response.read())
+
+
+def load_plugin(moviepilot: str):
+    sys.path.insert(0, moviepilot)
+    spec = importlib.util.spec_from_file_location("aliststrm_benchmark_plugin", PLUGIN_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.AlistStrm
+
+
+def count_results(method, counter: Counter, lock: threading.Lock):
+    """
+    包装插件的写入方法，按其返回的状态计数
+    """
+    def wrapper(*args, **kwargs):
+        status = method(*args, **kwargs)
+        with lock:
+            counter[status] += 1
+        return status
+    return wrapper
+
+
+def run_plugin(args, base_url: str, output_dir: str, data_dir: str, full_scan: bool, result_queue):
+    """
+    在独立进程中运行一次 generate_strm，峰值内存只统计本轮
+    """
+    plugin_class = load_plugin(args.moviepilot)
+    # 绕过插件基类初始化，避免依赖数据库
+    plugin = plugin_class.__new__(plugin_class)
+    plugin.get_data_path = lambda: Path(data_dir)
+    # 统计插件自身报告的写入结果，预热轮留下的文件不计入
+    strm_results, subtitle_results, lock = Counter(), Counter(), threading.Lock()
+    plugin._AlistStrm__write_strm = count_results(plugin._AlistStrm__write_strm, strm_results, lock)
+    plugin._AlistStrm__download_subtitle = count_results(plugin._AlistStrm__download_subtitle,
+                                                         subtitle_results, lock)
+    plugin.init_plugin({
+        "enabled": False,
+        "download_subtitle": args.subtitles > 0,
+        "scan_concurrency": 1,
+        "crawl_workers": args.workers,
+        "crawl_inflight": args.inflight,
+        "page_size": args.page_size,
+        "use_search": args.search,
+        "min_rate": args.min_rate,
+        "max_rate": args.max_rate,
+        "liststrm_confs": f"{base_url}#admin#password#{output_dir}#/",
+    })
+    start = time.perf_counter()
+    summary = plugin.generate_strm(base_url, "password", output_dir, "/", "admin", full_scan=full_scan)
+    elapsed = time.perf_counter() - start
+    plugin.stop_service()
+    result_queue.put({
+        "wall_time": round(elapsed, 3),
+        # Linux下ru_maxrss单位为KB
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "summary": summary,
+        "strm": dict(strm_results),
+        "subtitles": dict(subtitle_results),
+        "files_written": strm_results["created"] + strm_results["updated"] + subtitle_results["downloaded"],
+    })
+
+
+def run_once(args, context, base_url: str, output_dir: str, data_dir: str, full_scan: bool) -> dict:
+    request(base_url, "/__reset", "POST")
+    result_queue = context.Queue()
+    process = context.Process(target=run_plugin,
+                              args=(args, base_url, output_dir, data_dir, full_scan, result_queue))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    result["api_calls"] = request(base_url, "/__stats")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AlistStrm 离线性能基准")
+    parser.add_argument("--moviepilot", default=os.environ.get("MOVIEPILOT_PATH", "."),
+                        help="MoviePilot 源码目录，提供 app 包")
+    parser.add_argument("--depth", type=int, default=3, help="目录层数")
+    parser.add_argument("--fanout", type=int, default=6, help="每个目录的子目录数")
+    parser.add_argument("--files", type=int, default=5, help="每个目录的视频数")
+    parser.add_argument("--subtitles", type=int, default=0, help="每个目录的字幕数，大于0时开启字幕下载")
+    parser.add_argument("--latency", type=float, default=10, help="列表与搜索接口延迟（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0, help="列表与搜索接口返回429/5xx的比例")
+    parser.add_argument("--server-max-page", type=int, default=0, help="服务端单页条目上限，0为不限制")
+    parser.add_argument("--page-size", type=int, default=1000, help="插件列表分页大小，0为不分页")
+    parser.add_argument("--workers", type=int, default=4, help="插件遍历线程数")
+    parser.add_argument("--inflight", type=int, default=8, help="插件最大并发请求数")
+    parser.add_argument("--min-rate", type=int, default=1, help="插件最低请求速率")
+    parser.add_argument("--max-rate", type=int, default=50, help="插件最高请求速率")
+    parser.add_argument("--search", action="store_true", help="使用索引搜索枚举")
+    parser.add_argument("--mode", choices=("cold", "warm"), default="cold",
+                        help="cold：每轮全新目录全量扫描；warm：预先扫描一次后测量增量扫描")
+    parser.add_argument("--runs", type=int, default=3, help="测量轮数")
+    parser.add_argument("--seed", type=int, default=0, help="错误注入的随机种子")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    port_queue = context.Queue()
+    server = context.Process(target=serve, args=(args, port_queue), daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{port_queue.get()}"
+
+    directories = sum(args.fanout ** level for level in range(args.depth + 1))
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="aliststrm-bench-") as work_dir:
+            warm_output = os.path.join(work_dir, "warm", "strm")
+            warm_data = os.path.join(work_dir, "warm", "data")
+            if args.mode == "warm":
+                run_once(args, context, base_url, warm_output, warm_data, full_scan=True)
+            for run in range(args.runs):
+                if args.mode == "warm":
+                    output_dir, data_dir = warm_output, warm_data
+                else:
+                    output_dir = os.path.join(work_dir, f"run{run}", "strm")
+                    data_dir = os.path.join(work_dir, f"run{run}", "data")
+                results.append(run_once(args, context, base_url, output_dir, data_dir,
+                                        full_scan=args.mode == "cold"))
+    finally:
+        server.terminate()
+
+    report = {
+        "params": vars(args),
+        "directories": directories,
+        "runs": results,
+        "median_wall_time": statistics.median(result["wall_time"] for result in results),
+        "max_peak_rss_mb": max(result["peak_rss_mb"] for result in results),
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"目录 {directories} 个，模式 {args.mode}，延迟 {args.latency}ms，错误率 {args.error_rate}")
+    print(f"{'轮次':<6}{'耗时(s)':>10}{'峰值RSS(MB)':>14}{'写入文件':>8}  接口调用")
+    for run, result in enumerate(results, 1):
+        calls = " ".join(f"{name}={count}" for name, count in sorted(result["api_calls"].items()))
+        print(f"{run:<6}{result['wall_time']:>10.3f}{result['peak_rss_mb']:>14.1f}"
+              f"{result['files_written']:>8}  {calls}")
+    print(f"中位耗时 {report['median_wall_time']:.3f}s，最大峰值RSS {report['max_peak_rss_mb']:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+AutoFilm 离线性能基准
+
+在本地子进程中启动一个模拟的 Webdav 服务（Alist 风格，/dav/ 下 PROPFIND，/d/ 下载），
+支持 Depth: 0/1/infinity，目录结构、请求延迟与错误率均可配置；mount 模式会把同一目录树生成到临时目录，
+作为本地挂载遍历。每轮在独立子进程中端到端运行 AutoFilm.__generate_strm，
+统计 PROPFIND 次数、下载次数、耗时、峰值内存与本轮写入文件数，错误注入与重试抖动使用固定随机种子，结果可跨轮对比。
+
+需要 MoviePilot 源码目录提供 app 包，例如：
+    python benchmarks/autofilm_bench.py --moviepilot /path/to/MoviePilot --depth 4 --fanout 6 --latency 20
+    python benchmarks/autofilm_bench.py --moviepilot /path/to/MoviePilot --source deep --mode warm --json
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import quote, unquote, urlparse
+
+PLUGIN_FILE = Path(__file__).resolve().parent.parent / "plugins" / "autofilm" / "__init__.py"
+MODIFIED = 1704067200
+
+
+class FakeTree:
+    """
+    按参数确定性生成的目录树，目录名 dir_N，视频 video_N.mkv，字幕 video_N.srt
+    """
+
+    def __init__(self, depth: int, fanout: int, files: int, subtitles: int):
+        self.depth = depth
+        self.fanout = fanout
+        self.files = files
+        self.subtitles = subtitles
+
+    def list(self, path: str):
+        """
+        返回目录下的(名称, 是否目录)，目录不存在时返回None
+        """
+        parts = [part for part in path.split("/") if part]
+        if len(parts) > self.depth or any(not part.startswith("dir_") for part in parts):
+            return None
+        items = []
+        if len(parts) < self.depth:
+            items += [(f"dir_{i}", True) for i in range(self.fanout)]
+        items += [(f"video_{i}.mkv", False) for i in range(self.files)]
+        items += [(f"video_{i}.srt", False) for i in range(self.subtitles)]
+        return items
+
+    def walk(self, path: str, deep: bool):
+        """
+        逐个返回子条目的(路径, 是否目录)，目录路径以/结尾
+        """
+        for name, is_dir in self.list(path) or []:
+            child = path.rstrip("/") + "/" + name + ("/" if is_dir else "")
+            yield child, is_dir
+            if is_dir and deep:
+                yield from self.walk(child, deep)
+
+    @staticmethod
+    def subtitle(path: str) -> bytes:
+        return f"1\n00:00:01,000 --> 00:00:02,000\n{path}\n".encode()
+
+    def size(self, path: str, is_dir: bool) -> int:
+        if is_dir:
+            return 0
+        return len(self.subtitle(path)) if path.endswith(".srt") else 1 << 30
+
+    def materialize(self, root: str):
+        """
+        在本地生成同样的目录树，供挂载模式遍历
+        """
+        for path, is_dir in self.walk("/", True):
+            full_path = root + path
+            if is_dir:
+                os.makedirs(full_path, exist_ok=True)
+                continue
+            with open(full_path, "wb") as f:
+                f.write(self.subtitle(path) if path.endswith(".srt") else b"")
+            os.utime(full_path, (MODIFIED, MODIFIED))
+        for path, is_dir in self.walk("/", True):
+            if is_dir:
+                os.utime(root + path, (MODIFIED, MODIFIED))
+
+
+def serve(args, port_queue):
+    """
+    模拟Webdav服务进程
+    """
+    tree = FakeTree(args.depth, args.fanout, args.files, args.subtitles)
+    calls = Counter()
+    attempts = Counter()
+    lock = threading.Lock()
+    modified = formatdate(MODIFIED, usegmt=True)
+
+    def response_xml(href: str, path: str, is_dir: bool) -> str:
+        size = tree.size(path, is_dir)
+        resource_type = "<D:resourcetype><D:collection/></D:resourcetype>" if is_dir else "<D:resourcetype/>"
+        return (f"<D:response><D:href>{quote(href)}</D:href><D:propstat><D:prop>{resource_type}"
+                f"<D:getlastmodified>{modified}</D:getlastmodified>"
+                f"<D:getcontentlength>{size}</D:getcontentlength>"
+                f"<D:getetag>\"{MODIFIED:x}{size:x}\"</D:getetag>"
+                f"</D:prop><D:status>HTTP/1.1 200 OK</D:status></D:propstat></D:response>")
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *_):
+            pass
+
+        def count(self, name: str):
+            with lock:
+                calls[name] += 1
+
+        def reply(self, status: int, body: bytes, content_type: str = "text/plain"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def inject(self) -> bool:
+            """
+            模拟延迟与限流/服务端错误；是否出错只取决于种子、请求与第几次尝试，与并发顺序无关
+            """
+            if args.latency:
+                time.sleep(args.latency / 1000)
+            key = f"{self.command} {self.path}"
+            with lock:
+                attempts[key] += 1
+                rng = random.Random(f"{args.seed}:{key}:{attempts[key]}")
+            if rng.random() >= args.error_rate:
+                return False
+            self.count("errors")
+            self.reply(rng.choice((429, 502, 503)), b"busy")
+            return True
+
+        def do_PROPFIND(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            depth = self.headers.get("Depth", "1")
+            self.count(f"propfind_{depth}")
+            if self.inject():
+                return
+            path = unquote(urlparse(self.path).path)
+            if not path.startswith("/dav/"):
+                return self.reply(404, b"not found")
+            if depth == "infinity" and not args.allow_infinity:
+                return self.reply(403, b"<D:error xmlns:D=\"DAV:\"><D:propfind-finite-depth/></D:error>")
+            rel_path = path[len("/dav"):]
+            if tree.list(rel_path) is None:
+                return self.reply(404, b"not found")
+            body = ['<?xml version="1.0" encoding="utf-8"?><D:multistatus xmlns:D="DAV:">',
+                    response_xml(path, rel_path, True)]
+            if depth != "0":
+                body += [response_xml("/dav" + child, child, is_dir)
+                         for child, is_dir in tree.walk(rel_path, depth == "infinity")]
+            body.append("</D:multistatus>")
+            self.reply(207, "".join(body).encode(), "application/xml; charset=utf-8")
+
+        def do_GET(self):
+            path = unquote(urlparse(self.path).path)
+            if path == "/__stats":
+                with lock:
+                    return self.reply(200, json.dumps(calls).encode(), "application/json")
+            if path.startswith("/d/"):
+                self.count("download")
+                if self.inject():
+                    return
+                return self.reply(200, tree.subtitle(path[len("/d"):]))
+            self.reply(404, b"not found")
+
+        def do_POST(self):
+            if urlparse(self.path).path == "/__reset":
+                with lock:
+                    calls.clear()
+                    attempts.clear()
+                return self.reply(200, b"{}", "application/json")
+            self.reply(404, b"not found")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def request(base_url: str, path: str, method: str = "GET") -> dict:
+    from urllib.request import Request, urlopen
+    with urlopen(Request(base_url + path, data=b"" if method == "POST" else None, method=method)) as response:
+        return json.loads(response.read())
+
+
+def load_plugin(moviepilot: str):
+    sys.path.insert(0, moviepilot)
+    spec = importlib.util.spec_from_file_location("autofilm_benchmark_plugin", PLUGIN_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.AutoFilm
+
+
+def run_plugin(args, webdav_url: str, output_dir: str, data_dir: str, mount_path: str, full_scan: bool,
+               result_queue):
+    """
+    在独立进程中运行一次 __generate_strm，峰值内存只统计本轮
+    """
+    # 重试抖动使用固定种子，保证各轮可比
+    random.seed(args.seed)
+    plugin_class = load_plugin(args.moviepilot)
+    # 绕过插件基类初始化，避免依赖数据库
+    plugin = plugin_class.__new__(plugin_class)
+    plugin.get_data_path = lambda: Path(data_dir)
+    plugin.init_plugin({
+        "enabled": False,
+        "download_subtitle": args.subtitles > 0,
+        "crawl_workers": args.workers,
+        "crawl_inflight": args.inflight,
+        "write_workers": args.write_workers,
+        "subtitle_workers": args.subtitle_workers,
+        "deep_propfind": args.source == "deep",
+        "autofilm_confs": f"{webdav_url}#admin#password#{output_dir}",
+    })
+    start = time.perf_counter()
+    stats = plugin._AutoFilm__generate_strm(webdav_url, "admin", "password", output_dir, full_scan, mount_path)
+    elapsed = time.perf_counter() - start
+    plugin.stop_service()
+    result_queue.put({
+        "wall_time": round(elapsed, 3),
+        # Linux下ru_maxrss单位为KB
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        # 插件自身统计的本轮写入结果，预热轮留下的文件不计入
+        "results": dict(stats),
+        "files_written": stats["strm"] + stats["subtitle"],
+    })
+
+
+def run_once(args, context, server_url: str, output_dir: str, data_dir: str, mount_path: str,
+             full_scan: bool) -> dict:
+    request(server_url, "/__reset", "POST")
+    result_queue = context.Queue()
+    process = context.Process(target=run_plugin, args=(args, server_url + "/dav/", output_dir, data_dir,
+                                                       mount_path, full_scan, result_queue))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    result["requests"] = request(server_url, "/__stats")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AutoFilm 离线性能基准")
+    parser.add_argument("--moviepilot", default=os.environ.get("MOVIEPILOT_PATH", "."),
+                        help="MoviePilot 源码目录，提供 app 包")
+    parser.add_argument("--depth", type=int, default=3, help="目录层数")
+    parser.add_argument("--fanout", type=int, default=6, help="每个目录的子目录数")
+    parser.add_argument("--files", type=int, default=5, help="每个目录的视频数")
+    parser.add_argument("--subtitles", type=int, default=0, help="每个目录的字幕数，大于0时开启字幕下载")
+    parser.add_argument("--latency", type=float, default=10, help="PROPFIND与下载的延迟（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0, help="PROPFIND与下载返回429/5xx的比例")
+    parser.add_argument("--no-infinity", dest="allow_infinity", action="store_false",
+                        help="服务端拒绝Depth: infinity，用于测量深度遍历的回退")
+    parser.add_argument("--source", choices=("webdav", "deep", "mount"), default="webdav",
+                        help="webdav：逐目录PROPFIND；deep：Depth: infinity；mount：遍历本地生成的同样目录树")
+    parser.add_argument("--workers", type=int, default=4, help="插件遍历线程数")
+    parser.add_argument("--inflight", type=int, default=8, help="插件最大并发请求数")
+    parser.add_argument("--write-workers", type=int, default=4, help="插件strm写入线程数")
+    parser.add_argument("--subtitle-workers", type=int, default=4, help="插件字幕下载线程数")
+    parser.add_argument("--mode", choices=("cold", "warm"), default="cold",
+                        help="cold：每轮全新目录全量扫描；warm：预先扫描一次后测量增量扫描")
+    parser.add_argument("--runs", type=int, default=3, help="测量轮数")
+    parser.add_argument("--seed", type=int, default=0, help="错误注入与重试抖动的随机种子")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    port_queue = context.Queue()
+    server = context.Process(target=serve, args=(args, port_queue), daemon=True)
+    server.start()
+    server_url = f"http://127.0.0.1:{port_queue.get()}"
+
+    directories = sum(args.fanout ** level for level in range(args.depth + 1))
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="autofilm-bench-") as work_dir:
+            mount_path = None
+            if args.source == "mount":
+                mount_path = os.path.join(work_dir, "mount")
+                FakeTree(args.depth, args.fanout, args.files, args.subtitles).materialize(mount_path)
+            warm_output = os.path.join(work_dir, "warm", "strm")
+            warm_data = os.path.join(work_dir, "warm", "data")
+            if args.mode == "warm":
+                run_once(args, context, server_url, warm_output, warm_data, mount_path, full_scan=True)
+            for run in range(args.runs):
+                if args.mode == "warm":
+                    output_dir, data_dir = warm_output, warm_data
+                else:
+                    output_dir = os.path.join(work_dir, f"run{run}", "strm")
+                    data_dir = os.path.join(work_dir, f"run{run}", "data")
+                results.append(run_once(args, context, server_url, output_dir, data_dir, mount_path,
+                                        full_scan=args.mode == "cold"))
+    finally:
+        server.terminate()
+
+    report = {
+        "params": vars(args),
+        "directories": directories,
+        "runs": results,
+        "median_wall_time": statistics.median(result["wall_time"] for result in results),
+        "max_peak_rss_mb": max(result["peak_rss_mb"] for result in results),
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"目录 {directories} 个，来源 {args.source}，模式 {args.mode}，延迟 {args.latency}ms，错误率 {args.error_rate}")
+    print(f"{'轮次':<6}{'耗时(s)':>10}{'峰值RSS(MB)':>14}{'写入文件':>8}  请求数")
+    for run, result in enumerate(results, 1):
+        requests = " ".join(f"{name}={count}" for name, count in sorted(result["requests"].items()))
+        print(f"{run:<6}{result['wall_time']:>10.3f}{result['peak_rss_mb']:>14.1f}"
+              f"{result['files_written']:>8}  {requests}")
+    print(f"中位耗时 {report['median_wall_time']:.3f}s，最大峰值RSS {report['max_peak_rss_mb']:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
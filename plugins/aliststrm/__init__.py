@@ -1,15 +1,23 @@
 import urllib.parse
 import os
+import posixpath
+import re
 import requests
 import json
+import codecs
 import configparser
+import hashlib
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
-from time import sleep
+from time import sleep, time, monotonic
 
 import pytz
 from datetime import datetime, timedelta
-from typing import Any, List, Dict, Tuple, Optional
+from pathlib import Path
+from typing import Any, List, Dict, Tuple, Optional, Iterator, Callable
 
 from app.core.event import eventmanager, Event
 from app.schemas.types import EventType
@@ -20,11 +28,72 @@ from app.log import logger
 from app.plugins import _PluginBase
 from app.core.config import settings
 
+
+class AdaptiveRateLimiter:
+    """
+    自适应令牌桶限速：首次被限流前每次成功提速1次/秒，之后响应正常时每秒提速约1次，
+    遇到429、5xx或超时时速率减半
+    """
+
+    def __init__(self, min_rate: float, max_rate: float):
+        self._min_rate = min_rate
+        self._max_rate = max(max_rate, min_rate)
+        self._rate = min_rate
+        self._tokens = 1.0
+        self._updated = monotonic()
+        self._latency = None
+        self._slow_start = True
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def acquire(self):
+        """
+        取得一个令牌，令牌不足时等待
+        """
+        while True:
+            with self._lock:
+                now = monotonic()
+                # 桶容量为一秒的请求量，允许小幅突发
+                self._tokens = min(self._tokens + (now - self._updated) * self._rate, max(self._rate, 1.0))
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self._rate
+            sleep(wait_time)
+
+    def on_success(self, latency: float):
+        """
+        请求成功：延迟平稳时加性提速，延迟突增时小幅降速
+        """
+        with self._lock:
+            # 延迟超过平均值两倍且超过1秒视为服务端吃紧
+            if self._latency is not None and latency > max(self._latency * 2, 1.0):
+                self._rate = max(self._rate * 0.9, self._min_rate)
+            elif self._slow_start:
+                self._rate = min(self._rate + 1, self._max_rate)
+            else:
+                self._rate = min(self._rate + 1 / self._rate, self._max_rate)
+            self._latency = latency if self._latency is None else self._latency * 0.8 + latency * 0.2
+
+    def on_throttle(self, retry_after: float = 0):
+        """
+        被限流或服务端出错：速率减半并清空令牌，服务端指定了Retry-After时暂停相应时间
+        """
+        with self._lock:
+            self._slow_start = False
+            self._rate = max(self._rate / 2, self._min_rate)
+            self._tokens = min(self._tokens, 0) - retry_after * self._rate
+
+
 class AlistStrm(_PluginBase):
     plugin_name = "AlistStrm"
     plugin_desc = "生成 Alist 云盘视频的 Strm 文件"
     plugin_icon = "https://raw.githubusercontent.com/thsrite/MoviePilot-Plugins/main/icons/create.png"
-    plugin_version = "1.0"
+    plugin_version = "2.4"
     plugin_author = "kufei326"
     author_url = "https://github.com/kufei326"
     plugin_config_prefix = "aliststrm_"
@@ -34,15 +103,54 @@ class AlistStrm(_PluginBase):
     _enabled = False
     _cron = None
     _onlyonce = False
+    _full_scan = False
     _download_subtitle = False
 
     _liststrm_confs = None
 
     _try_max = 15
-    
+    # 同时处理的配置条数
+    _scan_concurrency = 2
+    # 遍历目录的工作线程数
+    _crawl_workers = 4
+    # 每个Alist主机同时在途的列表请求上限
+    _crawl_inflight = 8
+    _semaphores: Dict[str, threading.BoundedSemaphore] = {}
+    # 列表分页大小，0为不分页
+    _page_size = 1000
+    # 使用Alist索引搜索枚举视频，索引超过该小时数未更新时视为过期
+    _use_search = False
+    _index_max_age = 24
+    # 字幕下载线程数
+    _subtitle_workers = 4
+    # 清理远端已删除文件对应的本地文件，删除比例超过阈值（%）时取消
+    _prune = False
+    _prune_dry_run = False
+    _prune_threshold = 20
+    # 每个Alist服务器复用一个长连接会话
+    _sessions: Dict[str, requests.Session] = {}
+    _session_lock = threading.Lock()
+    # 登录token缓存 (服务器, 用户) -> (token, 获取时间)，Alist默认有效期48小时
+    _tokens: Dict[Tuple[str, str], Tuple[str, float]] = {}
+    # 每个 (服务器, 用户) 单独一把登录锁，慢服务器登录不阻塞其他配置
+    _token_locks: Dict[Tuple[str, str], threading.Lock] = {}
+    _token_lock = threading.Lock()
+    _token_ttl = 46 * 3600
+    # 每个Alist主机的自适应限速器，速率范围（次/秒）
+    _rate_limiters: Dict[str, AdaptiveRateLimiter] = {}
+    _min_rate = 1
+    _max_rate = 50
+    _request_timeout = 60
+
     _video_formats = ('.mp4', '.avi', '.rmvb', '.wmv', '.mov', '.mkv', '.flv', '.ts', '.webm', '.iso', '.mpg', '.m2ts')
     _subtitle_formats = ('.ass', '.srt', '.ssa', '.sub')
     UserAgent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36 Edg/123.0.0.0"
+    # 断点保存间隔（秒）
+    _checkpoint_interval = 120
+    # 每条配置同时只运行一次，定时、立即运行与命令触发重叠时后来者跳过
+    _conf_locks: Dict[Tuple[str, str, str, str], threading.Lock] = {}
+    # 退出事件
+    _event = threading.Event()
     # 定时器
     _scheduler: Optional[BackgroundScheduler] = None
 
@@ -51,8 +159,21 @@ class AlistStrm(_PluginBase):
             self._enabled = config.get("enabled")
             self._cron = config.get("cron")
             self._onlyonce = config.get("onlyonce")
+            self._full_scan = config.get("full_scan")
             self._download_subtitle = config.get("download_subtitle")
             self._liststrm_confs = config.get("liststrm_confs").split("\n")
+            self._scan_concurrency = self.__to_int(config.get("scan_concurrency"), 2)
+            self._crawl_workers = self.__to_int(config.get("crawl_workers"), 4)
+            self._crawl_inflight = self.__to_int(config.get("crawl_inflight"), 8)
+            self._page_size = self.__to_int(config.get("page_size"), 1000, minimum=0)
+            self._use_search = config.get("use_search")
+            self._index_max_age = self.__to_int(config.get("index_max_age"), 24)
+            self._subtitle_workers = self.__to_int(config.get("subtitle_workers"), 4)
+            self._prune = config.get("prune")
+            self._prune_dry_run = config.get("prune_dry_run")
+            self._prune_threshold = self.__to_int(config.get("prune_threshold"), 20)
+            self._min_rate = self.__to_int(config.get("min_rate"), 1)
+            self._max_rate = self.__to_int(config.get("max_rate"), 50)
 
         # 停止现有任务
         self.stop_service()
@@ -64,11 +185,13 @@ class AlistStrm(_PluginBase):
             # 运行一次定时服务
             if self._onlyonce:
                 logger.info("AutoFilm执行服务启动，立即运行一次")
-                self._scheduler.add_job(func=self.scan, trigger='date',
+                self._scheduler.add_job(func=self.scan, kwargs={"full_scan": self._full_scan}, trigger='date',
                                         run_date=datetime.now(tz=pytz.timezone(settings.TZ)) + timedelta(seconds=3),
                                         name="AutoFilm单次执行")
-                # 关闭一次性开关
+                # 关闭一次性开关 全量扫描
                 self._onlyonce = False
+                self._full_scan = False
+                self.__update_config()
 
             # 周期运行
             if self._cron:
@@ -87,7 +210,7 @@ class AlistStrm(_PluginBase):
                 self._scheduler.start()
 
     @eventmanager.register(EventType.PluginAction)
-    def scan(self, event: Event = None):
+    def scan(self, event: Event = None, full_scan: bool = False):
         if not self._enabled:
             logger.error("AlistStrm插件未开启")
             return
@@ -104,9 +227,11 @@ class AlistStrm(_PluginBase):
                               title="AlistStrm开始生成strm ...",
                               userid=event.event_data.get("user"))
 
-        logger.info("AlistStrm生成Strm任务开始")
-        
-        # 生成strm文件
+        logger.info(f"AlistStrm生成Strm任务开始，{'全量' if full_scan else '增量'}扫描")
+
+        # 多条配置并发处理，每条配置完成后单独汇报
+        futures = {}
+        executor = ThreadPoolExecutor(max_workers=self._scan_concurrency, thread_name_prefix="aliststrm-conf")
         for liststrm_conf in self._liststrm_confs:
             # 格式 Webdav服务器地址:账号:密码:本地目录:Webdav开始目录
             if not liststrm_conf:
@@ -122,7 +247,22 @@ class AlistStrm(_PluginBase):
                 continue
 
             # 生成strm文件
-            self.generate_strm(alist_url, alist_password, local_path, root_path, alist_user)
+            future = executor.submit(self.generate_strm, alist_url, alist_password, local_path, root_path,
+                                     alist_user, full_scan)
+            futures[future] = f"{alist_url}{root_path}"
+
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"{futures[future]} 生成strm文件出错：{str(e)}")
+                result = f"生成strm文件出错：{str(e)}"
+            if event:
+                self.post_message(channel=event.event_data.get("channel"),
+                                  title=f"{futures[future]} strm生成完成",
+                                  text=result,
+                                  userid=event.event_data.get("user"))
+        executor.shutdown()
 
         logger.info("云盘strm生成任务完成")
         if event:
@@ -130,127 +270,813 @@ class AlistStrm(_PluginBase):
                               title="云盘strm生成任务完成！",
                               userid=event.event_data.get("user"))
 
-    def generate_strm(self, alist_url: str, alist_password: str, local_path: str, root_path: str, alist_user: str):
-        # 获取token
-        token = self.__get_token(alist_url, alist_password, alist_user)
+    def generate_strm(self, alist_url: str, alist_password: str, local_path: str, root_path: str, alist_user: str,
+                      full_scan: bool = False) -> str:
+        """
+        生成一条配置的strm文件，返回处理结果摘要
+        """
+        if self._event.is_set():
+            return "服务已停止"
+        # 同一配置共用清单、断点与日志文件，不能并发运行
+        conf_key = (alist_url, alist_user, root_path, local_path)
+        with self._session_lock:
+            conf_lock = self._conf_locks.setdefault(conf_key, threading.Lock())
+        if not conf_lock.acquire(blocking=False):
+            logger.warning(f"{alist_url}{root_path} 上一次生成strm文件尚未结束，跳过本次")
+            return "上一次生成尚未结束，已跳过"
+        try:
+            return self.__generate_strm(alist_url, alist_password, local_path, root_path, alist_user, full_scan)
+        finally:
+            conf_lock.release()
 
-        # 遍历目录生成strm文件
-        traversed_paths = self.__traverse_directory(local_path, alist_url, token)
-        self._create_strm_files(traversed_paths, local_path, alist_url, token)
-
-    def __get_token(self, url: str, password: str, user: str) -> str:
-        api_base_url = url + "/api"
-        login_path = "/auth/login"
-        url_login = api_base_url + login_path
-        payload_login = json.dumps({
-            "username": user,  # Assume username is a class variable
-            "password": password
-        })
+    def __generate_strm(self, alist_url: str, alist_password: str, local_path: str, root_path: str,
+                        alist_user: str, full_scan: bool = False) -> str:
+        logger.info(f"{alist_url}{root_path} 开始生成strm文件")
+        # 获取token，优先使用缓存
+        if not self.__get_token(alist_url, alist_password, alist_user):
+            logger.error(f"{alist_url} 登录失败，跳过生成strm文件")
+            return "登录失败"
 
-        headers_login = {
-            'User-Agent': self.UserAgent,
-            'Content-Type': 'application/json'
-        }
+        # 字幕在遍历过程中提交到独立线程池下载，不阻塞目录遍历
+        subtitle_futures = {}
+        subtitle_executor = ThreadPoolExecutor(max_workers=self._subtitle_workers,
+                                               thread_name_prefix="aliststrm-subtitle")
+
+        def on_subtitle(path: str, item: dict):
+            future = subtitle_executor.submit(self.__download_subtitle, path, item, root_path, alist_url, local_path)
+            subtitle_futures[future] = path
+
+        on_subtitle = on_subtitle if self._download_subtitle else None
+        try:
+            # 优先通过索引搜索枚举视频，索引不可用或过期时回退为遍历目录
+            strm_stats = None
+            if self._use_search:
+                strm_stats = self.__search_videos(root_path, alist_url, alist_user, alist_password, local_path,
+                                                  on_subtitle)
+
+            searched = strm_stats is not None
+
+            # 边遍历边生成strm文件，每个目录只列出一次，未变化的目录直接跳过
+            if strm_stats is None:
+                strm_stats = self.__crawl_directory(root_path, alist_url, alist_user, alist_password, local_path,
+                                                    full_scan, on_subtitle)
+        finally:
+            # 服务停止时不再等待未开始的字幕下载
+            subtitle_executor.shutdown(wait=True, cancel_futures=self._event.is_set())
+
+        summary = (f"strm文件新增 {strm_stats['created']} 个，"
+                   f"更新 {strm_stats['updated']} 个，未变化 {strm_stats['unchanged']} 个")
+        if subtitle_futures:
+            subtitle_stats = Counter()
+            failed_paths = set()
+            for future, path in subtitle_futures.items():
+                result = 'failed' if future.cancelled() else future.result()
+                if result == 'failed':
+                    failed_paths.add(path)
+                if not future.cancelled():
+                    subtitle_stats[result] += 1
+            # 字幕下载失败的目录下次增量扫描时重新列出
+            if failed_paths:
+                self.__invalidate_directories(failed_paths, alist_url, alist_user, root_path, local_path)
+            summary += (f"；字幕下载 {subtitle_stats['downloaded']} 个，"
+                        f"跳过 {subtitle_stats['skipped']} 个，失败 {subtitle_stats['failed']} 个")
+        if strm_stats['failed_dirs']:
+            summary += f"；{strm_stats['failed_dirs']} 个目录获取失败"
+        if strm_stats['interrupted']:
+            summary += "；遍历被中断，下次从断点继续"
+
+        # 只有完整遍历成功时才清理，避免把获取失败的目录误判为已删除
+        # 索引可能滞后于实际文件（非管理员账号无法检查索引是否过期），搜索结果不用于清理
+        if self._prune:
+            if searched:
+                summary += "，本次使用索引搜索，跳过清理失效文件"
+            elif strm_stats['failed_dirs'] or strm_stats['interrupted']:
+                summary += "，跳过清理失效文件"
+            else:
+                summary += "；" + self.__prune(alist_url, alist_user, root_path, local_path)
+        logger.info(f"{alist_url}{root_path} {summary}")
+        return summary
+
+    def __get_token(self, url: str, password: str, user: str, expired_token: str = None) -> Optional[str]:
+        """
+        获取登录token，按服务器和用户缓存，过期或失效时重新登录
+        """
+        key = (url, user)
+        token = self.__cached_token(key, expired_token)
+        if token:
+            return token
+        with self._token_lock:
+            login_lock = self._token_locks.setdefault(key, threading.Lock())
+        with login_lock:
+            # 等待期间其他线程可能已经重新登录
+            token = self.__cached_token(key, expired_token)
+            if token:
+                return token
+
+            api_base_url = url + "/api"
+            login_path = "/auth/login"
+            url_login = api_base_url + login_path
+            payload_login = json.dumps({
+                "username": user,
+                "password": password
+            })
+
+            headers_login = {
+                'User-Agent': self.UserAgent,
+                'Content-Type': 'application/json'
+            }
 
-        response_login = requests.post(url_login, headers=headers_login, data=payload_login)
-        token = json.loads(response_login.text)['data']['token']
-        return token
-
-    def __traverse_directory(self, path, alist_url, token):
-        traversed_paths = []
-        json_structure = {}
-        self.__traverse_directory_recursively(path, json_structure, traversed_paths, alist_url, token)
-    def __traverse_directory(self, path, alist_url, token):
-        traversed_paths = []
-        json_structure = {}
-        self.__traverse_directory_recursively(path, json_structure, traversed_paths, alist_url, token)
-        return traversed_paths
-
-    def __traverse_directory_recursively(self, path, json_structure, traversed_paths, alist_url, token):
-        directory_info = self._list_directory(path, alist_url, token)
-        if directory_info.get('data') and directory_info['data'].get('content'):
-            for item in directory_info['data']['content']:
-                if item['is_dir']:
-                    new_path = os.path.join(path, item['name'])
-                    sleep(1)
-                    if new_path in traversed_paths:
+            try:
+                response_login = self._requests_retry_session(url).post(url_login, headers=headers_login,
+                                                                        data=payload_login,
+                                                                        timeout=self._request_timeout)
+                result = json.loads(response_login.text)
+            except Exception as e:
+                logger.error(f"{url} 登录失败：{str(e)}")
+                return None
+            if result.get('code') != 200 or not result.get('data'):
+                logger.error(f"{url} 登录失败：{result.get('message')}")
+                return None
+            token = result['data']['token']
+            self._tokens[key] = (token, time())
+            return token
+
+    def __cached_token(self, key: Tuple[str, str], expired_token: str = None) -> Optional[str]:
+        """
+        读取未过期的缓存token，不加锁
+        """
+        cached = self._tokens.get(key)
+        if cached and cached[0] != expired_token and time() - cached[1] < self._token_ttl:
+            return cached[0]
+        return None
+
+    def __crawl_directory(self, root_path, alist_url, alist_user, alist_password, local_path,
+                          full_scan: bool = False, on_subtitle: Callable[[str, dict], None] = None) -> Counter:
+        """
+        使用线程池并发遍历目录，每个目录的列表返回后立即生成其中的strm文件
+        """
+        alist_conf = (alist_url, alist_user, root_path, local_path)
+        manifest_file = self.__conf_file("manifest", *alist_conf)
+        checkpoint_file = self.__conf_file("checkpoint", *alist_conf)
+        journal_file = self.__journal_file(*alist_conf)
+        # 上次遍历未完成时从断点继续，主动全量扫描时重新开始
+        checkpoint = None if full_scan else self.__load_json(checkpoint_file)
+        if checkpoint:
+            full_scan = checkpoint.get('full_scan', False)
+        old_manifest = {} if full_scan else self.__load_json(manifest_file, {})
+        if checkpoint:
+            frontier = deque(tuple(item) for item in checkpoint['frontier'])
+            # 已完成目录的清单记录从日志中重建
+            new_manifest = self.__replay_journal(journal_file, old_manifest)
+            strm_stats = Counter(failed_dirs=checkpoint.get('failed_dirs', 0))
+            logger.info(f"{alist_url}{root_path} 从断点继续遍历，已完成 {len(new_manifest)} 个目录，"
+                        f"待遍历 {len(frontier)} 个目录")
+        else:
+            # 待遍历目录按后进先出处理，内存只与遍历边界相关
+            frontier = deque([(root_path, None)])
+            new_manifest = {}
+            strm_stats = Counter()
+        resumed_count = len(new_manifest)
+        listed_count = 0
+        checkpoint_time = monotonic()
+        journal_file.parent.mkdir(parents=True, exist_ok=True)
+        # 每完成一个目录向日志追加一行，断点本身只保存待遍历目录
+        with open(journal_file, 'a' if checkpoint else 'w', encoding='utf-8') as journal, \
+                ThreadPoolExecutor(max_workers=self._crawl_workers, thread_name_prefix="aliststrm") as executor:
+            pending = {}
+            while frontier or pending:
+                if self._event.is_set():
+                    # 服务停止：保存断点，在途目录下次重新列出
+                    frontier.extend(pending.values())
+                    journal.flush()
+                    self.__save_checkpoint(checkpoint_file, full_scan, frontier, strm_stats)
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    logger.warning(f"{alist_url}{root_path} 遍历已中断，断点已保存，待遍历 {len(frontier)} 个目录")
+                    strm_stats['interrupted'] = 1
+                    return strm_stats
+                while frontier and len(pending) < self._crawl_workers * 2:
+                    path, modified = frontier.pop()
+                    future = executor.submit(self.__process_directory, path, root_path,
+                                             alist_url, alist_user, alist_password, local_path)
+                    pending[future] = (path, modified)
+                done, _ = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, modified = pending.pop(future)
+                    try:
+                        entry, directory_stats, subtitles = future.result()
+                    except Exception as e:
+                        logger.error(f"获取目录 {path} 失败：{str(e)}")
+                        strm_stats['failed_dirs'] += 1
                         continue
-                    traversed_paths.append(new_path)
-                    new_json_object = {}
-                    json_structure[item['name']] = new_json_object
-                    self.__traverse_directory_recursively(new_path, new_json_object, traversed_paths, alist_url, token)
-                elif item['name'].endswith(self._video_formats):
-                    json_structure[item['name']] = {
-                        'type': 'file',
-                        'size': item['size'],
-                        'modified': item['modified']
-                    }
+                    listed_count += 1
+                    strm_stats.update(directory_stats)
+                    if on_subtitle:
+                        for item in subtitles:
+                            on_subtitle(path, item)
+                    entry['modified'] = modified
+                    new_manifest[path] = entry
+                    self.__append_journal(journal, path, entry)
+                    for name, dir_modified in entry['dirs'].items():
+                        self.__schedule_directory(posixpath.join(path, name), dir_modified,
+                                                  old_manifest, new_manifest, frontier, journal)
+                # 定期保存断点，先落盘日志，保证断点中已不在待遍历队列的目录都能从日志恢复
+                if monotonic() - checkpoint_time > self._checkpoint_interval:
+                    journal.flush()
+                    self.__save_checkpoint(checkpoint_file, full_scan, list(frontier) + list(pending.values()),
+                                           strm_stats)
+                    checkpoint_time = monotonic()
+
+        self.__save_json(manifest_file, new_manifest)
+        # 遍历完整结束，丢弃断点与日志
+        for data_file in (checkpoint_file, journal_file):
+            if data_file.exists():
+                data_file.unlink()
+        logger.info(f"{alist_url}{root_path} 共列出 {listed_count} 个目录，"
+                    f"跳过 {len(new_manifest) - listed_count - resumed_count} 个未变化目录")
+        return strm_stats
+
+    def __invalidate_directories(self, paths, alist_url, alist_user, root_path, local_path):
+        """
+        清除清单与断点日志中这些目录的修改时间，使下次增量扫描重新列出
+        """
+        alist_conf = (alist_url, alist_user, root_path, local_path)
+        manifest_file = self.__conf_file("manifest", *alist_conf)
+        manifest = self.__load_json(manifest_file)
+        if manifest:
+            for path in paths:
+                if path in manifest:
+                    manifest[path]['modified'] = None
+            self.__save_json(manifest_file, manifest)
+        if self.__conf_file("checkpoint", *alist_conf).exists():
+            with open(self.__journal_file(*alist_conf), 'a', encoding='utf-8') as journal:
+                for path in paths:
+                    journal.write(json.dumps({'path': path, 'stale': True}, ensure_ascii=False) + '\n')
 
-    def _list_directory(self, root_path, alist_url, token):
-        url_list = alist_url + "/api/fs/list"
-        payload_list = json.dumps({
-            "path": root_path,
-            "password": "",  
-            "page": 1,
-            "per_page": 0,
-            "refresh": False
+    def __journal_file(self, alist_url, alist_user, root_path, local_path) -> Path:
+        return self.__conf_file("checkpoint", alist_url, alist_user, root_path, local_path).with_suffix('.jsonl')
+
+    def __save_checkpoint(self, checkpoint_file: Path, full_scan: bool, frontier, strm_stats: Counter):
+        """
+        保存遍历断点：待遍历目录与失败目录数，已完成目录记录在日志中
+        """
+        self.__save_json(checkpoint_file, {
+            'full_scan': full_scan,
+            'frontier': list(frontier),
+            'failed_dirs': strm_stats['failed_dirs']
         })
-        headers_list = {
-            'Authorization': token,
+
+    @staticmethod
+    def __append_journal(journal, path: str, entry: dict = None):
+        """
+        记录一个已完成目录，沿用上次清单的目录只记录路径
+        """
+        record = {'path': path, 'entry': entry} if entry is not None else {'path': path}
+        journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    @staticmethod
+    def __replay_journal(journal_file: Path, old_manifest: dict) -> dict:
+        """
+        按日志重建已完成目录的清单，最后一行可能只写了一半，直接忽略
+        """
+        new_manifest = {}
+        if not journal_file.exists():
+            return new_manifest
+        with open(journal_file, 'r', encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                path = record['path']
+                if record.get('stale'):
+                    if path in new_manifest:
+                        new_manifest[path] = dict(new_manifest[path], modified=None)
+                elif 'entry' in record:
+                    new_manifest[path] = record['entry']
+                elif path in old_manifest:
+                    new_manifest[path] = old_manifest[path]
+        return new_manifest
+
+    @classmethod
+    def __schedule_directory(cls, path, modified, old_manifest, new_manifest, frontier, journal):
+        """
+        目录修改时间与清单一致时沿用清单中的整棵子树，否则加入待遍历队列
+        """
+        stack = [(path, modified)]
+        while stack:
+            path, modified = stack.pop()
+            old_entry = old_manifest.get(path)
+            if modified and old_entry and old_entry.get('modified') == modified:
+                new_manifest[path] = old_entry
+                cls.__append_journal(journal, path)
+                stack.extend((posixpath.join(path, name), dir_modified)
+                             for name, dir_modified in old_entry['dirs'].items())
+            else:
+                frontier.append((path, modified))
+
+    def __process_directory(self, path, root_path, alist_url, alist_user, alist_password,
+                            local_path) -> Tuple[dict, Counter, List[dict]]:
+        """
+        列出单个目录并生成其中视频的strm文件，返回该目录的清单记录、strm写入统计与字幕条目
+        """
+        entry = {'files': {}, 'dirs': {}}
+        strm_stats = Counter()
+        subtitles = []
+        for item in self._iter_directory(path, alist_url, alist_user, alist_password):
+            if item['is_dir']:
+                entry['dirs'][item['name']] = item['modified']
+            elif item['name'].endswith(self._video_formats):
+                entry['files'][item['name']] = [item['size'], item['modified']]
+                strm_stats[self.__write_strm(path, item['name'], root_path, alist_url, local_path)] += 1
+            elif self._download_subtitle and item['name'].endswith(self._subtitle_formats):
+                entry['files'][item['name']] = [item['size'], item['modified']]
+                subtitles.append(item)
+        return entry, strm_stats, subtitles
+
+    def __search_videos(self, root_path, alist_url, alist_user, alist_password, local_path,
+                        on_subtitle: Callable[[str, dict], None] = None) -> Optional[Counter]:
+        """
+        通过Alist索引搜索枚举根目录下的视频并生成strm文件，索引不可用或过期时返回None
+        """
+        if not self.__index_ready(alist_url, alist_user, alist_password):
+            return None
+        manifest = {}
+        strm_stats = Counter()
+        per_page = self._page_size or 1000
+        root_prefix = root_path.rstrip('/') + '/'
+        try:
+            search_formats = self._video_formats + (self._subtitle_formats if on_subtitle else ())
+            for file_format in search_formats:
+                page = 1
+                listed = 0
+                while True:
+                    payload_search = {
+                        "parent": root_path,
+                        "keywords": file_format.lstrip('.'),
+                        "scope": 2,
+                        "page": page,
+                        "per_page": per_page,
+                        "password": ""
+                    }
+                    header, items = self.__request_api(alist_url, "/api/fs/search", payload_search,
+                                                       alist_user, alist_password, stream=True)
+                    if header.get('code') != 200:
+                        logger.warning(f"{alist_url} 索引搜索不可用，改为遍历目录：{header.get('message')}")
+                        return None
+                    count = 0
+                    for item in items:
+                        count += 1
+                        listed += 1
+                        parent = item['parent']
+                        if item['is_dir'] or not item['name'].endswith(file_format) \
+                                or (parent != root_path and not parent.startswith(root_prefix)):
+                            continue
+                        entry = manifest.setdefault(parent, {'files': {}, 'dirs': {}, 'modified': None})
+                        entry['files'][item['name']] = [item['size'], None]
+                        if file_format in self._subtitle_formats:
+                            on_subtitle(parent, item)
+                        else:
+                            strm_stats[self.__write_strm(parent, item['name'], root_path, alist_url,
+                                                         local_path)] += 1
+                    if self.__last_page(header, count, listed, per_page):
+                        break
+                    page += 1
+        except Exception as e:
+            logger.warning(f"{alist_url} 索引搜索出错，改为遍历目录：{str(e)}")
+            return None
+
+        # 搜索结果没有目录修改时间，下次增量遍历时会重新列出这些目录
+        alist_conf = (alist_url, alist_user, root_path, local_path)
+        self.__save_json(self.__conf_file("manifest", *alist_conf), manifest)
+        logger.info(f"{alist_url}{root_path} 通过索引搜索找到 {sum(strm_stats.values())} 个视频")
+        return strm_stats
+
+    def __index_ready(self, alist_url, alist_user, alist_password) -> bool:
+        """
+        检查Alist索引是否可用且未过期，无权限查询索引进度时直接尝试搜索
+        """
+        headers = {
+            'Authorization': self.__get_token(alist_url, alist_password, alist_user) or '',
+            'User-Agent': self.UserAgent
+        }
+        try:
+            self.__get_rate_limiter(alist_url).acquire()
+            response = self._requests_retry_session(alist_url).get(alist_url + "/api/admin/index/progress",
+                                                                   headers=headers, timeout=self._request_timeout)
+            result = json.loads(response.text)
+        except Exception as e:
+            logger.warning(f"{alist_url} 获取索引进度失败：{str(e)}")
+            return True
+        if result.get('code') != 200 or not result.get('data'):
+            return True
+        progress = result['data']
+        if progress.get('error') or not progress.get('is_done'):
+            logger.warning(f"{alist_url} 索引未完成或出错，改为遍历目录：{progress.get('error')}")
+            return False
+        last_done_time = self.__parse_time(progress.get('last_done_time'))
+        if not last_done_time or datetime.now(tz=pytz.utc) - last_done_time > timedelta(hours=self._index_max_age):
+            logger.warning(f"{alist_url} 索引已过期（{progress.get('last_done_time')}），改为遍历目录")
+            return False
+        return True
+
+    @staticmethod
+    def __parse_time(value: str) -> Optional[datetime]:
+        """
+        解析Alist返回的RFC3339时间，纳秒精度截断为微秒
+        """
+        if not value:
+            return None
+        value = re.sub(r'(\.\d{6})\d+', r'\1', value.replace('Z', '+00:00'))
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+
+    def __write_strm(self, path, name, root_path, alist_url, local_path) -> str:
+        """
+        生成单个视频的strm文件，内容未变化时不写入，返回 created/updated/unchanged
+        """
+        target_directory = os.path.join(local_path, os.path.relpath(path, root_path))
+        strm_path = os.path.join(target_directory, name.rsplit('.', 1)[0] + '.strm')
+        # 对整个文件路径进行URL编码，拼接完整的视频URL
+        video_url = alist_url + '/d' + urllib.parse.quote(posixpath.join(path, name))
+
+        try:
+            with open(strm_path, 'r', encoding='utf-8') as strm_file:
+                if strm_file.read() == video_url:
+                    return 'unchanged'
+            status = 'updated'
+        except FileNotFoundError:
+            os.makedirs(target_directory, exist_ok=True)
+            status = 'created'
+        except (OSError, UnicodeDecodeError):
+            status = 'updated'
+
+        # 先写临时文件再原子替换，避免媒体服务器读到写了一半的文件
+        tmp_path = os.path.join(target_directory, f".{os.path.basename(strm_path)}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as strm_file:
+            strm_file.write(video_url)
+        os.replace(tmp_path, strm_path)
+        return status
+
+    def __download_subtitle(self, path, item, root_path, alist_url, local_path) -> str:
+        """
+        流式下载单个字幕文件，本地文件大小与修改时间一致时跳过，返回 downloaded/skipped/failed
+        """
+        target_directory = os.path.join(local_path, os.path.relpath(path, root_path))
+        subtitle_path = os.path.join(target_directory, item['name'])
+        modified = self.__parse_time(item.get('modified'))
+        try:
+            stat = os.stat(subtitle_path)
+            if stat.st_size == item['size'] and (not modified or int(stat.st_mtime) == int(modified.timestamp())):
+                return 'skipped'
+        except FileNotFoundError:
+            pass
+
+        subtitle_url = alist_url + '/d' + urllib.parse.quote(posixpath.join(path, item['name']))
+        if item.get('sign'):
+            subtitle_url += f"?sign={item['sign']}"
+        tmp_path = os.path.join(target_directory, f".{item['name']}.tmp")
+        rate_limiter = self.__get_rate_limiter(alist_url)
+        try:
+            os.makedirs(target_directory, exist_ok=True)
+            rate_limiter.acquire()
+            with self._requests_retry_session(alist_url).get(subtitle_url, headers={'User-Agent': self.UserAgent},
+                                                             stream=True, timeout=self._request_timeout) as response:
+                if response.status_code == 429 or response.status_code >= 500:
+                    rate_limiter.on_throttle()
+                response.raise_for_status()
+                with open(tmp_path, 'wb') as subtitle_file:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        subtitle_file.write(chunk)
+            os.replace(tmp_path, subtitle_path)
+            if modified:
+                os.utime(subtitle_path, (modified.timestamp(), modified.timestamp()))
+            return 'downloaded'
+        except Exception as e:
+            logger.warning(f"下载字幕 {subtitle_url} 失败：{str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return 'failed'
+
+    def __conf_file(self, kind, alist_url, alist_user, root_path, local_path) -> Path:
+        """
+        每条配置对应一组数据文件，kind为 manifest（远端清单）或 index（已生成文件索引）
+        """
+        conf_key = hashlib.md5(f"{alist_url}#{alist_user}#{root_path}#{local_path}".encode()).hexdigest()
+        return self.get_data_path() / kind / f"{conf_key}.json"
+
+    @staticmethod
+    def __load_json(data_file: Path, default: Any = None) -> Any:
+        if not data_file.exists():
+            return default
+        try:
+            return json.loads(data_file.read_text(encoding='utf-8'))
+        except Exception as e:
+            logger.warning(f"读取 {data_file} 失败：{str(e)}")
+            return default
+
+    @staticmethod
+    def __save_json(data_file: Path, data: Any):
+        data_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = data_file.with_suffix('.tmp')
+        tmp_file.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp_file, data_file)
+
+    def __prune(self, alist_url, alist_user, root_path, local_path) -> str:
+        """
+        对比本次扫描得到的远端清单与已生成文件索引，删除远端已不存在的文件及其留下的空目录
+        """
+        alist_conf = (alist_url, alist_user, root_path, local_path)
+        manifest = self.__load_json(self.__conf_file("manifest", *alist_conf), {})
+        index_file = self.__conf_file("index", *alist_conf)
+        old_index = set(self.__load_json(index_file, []))
+
+        expected = set()
+        for path, entry in manifest.items():
+            relative_directory = os.path.relpath(path, root_path)
+            for name in entry['files']:
+                if name.endswith(self._video_formats):
+                    name = name.rsplit('.', 1)[0] + '.strm'
+                expected.add(os.path.normpath(os.path.join(relative_directory, name)))
+
+        if not self._download_subtitle:
+            # 未开启字幕下载时不管理字幕：清单中的字幕不计入，之前下载的字幕原样保留
+            expected = {relative_path for relative_path in expected
+                        if not relative_path.endswith(self._subtitle_formats)}
+            expected |= {relative_path for relative_path in old_index
+                         if relative_path.endswith(self._subtitle_formats)}
+        stale = sorted(old_index - expected)
+        if not stale:
+            self.__save_json(index_file, sorted(expected))
+            return "没有需要清理的文件"
+        if len(stale) > len(old_index) * self._prune_threshold / 100:
+            logger.warning(f"{alist_url}{root_path} 待清理 {len(stale)}/{len(old_index)} 个文件，"
+                           f"超过 {self._prune_threshold}% 的安全阈值，已取消清理")
+            self.__save_json(index_file, sorted(old_index | expected))
+            return f"待清理 {len(stale)} 个文件超过安全阈值，已取消清理"
+        if self._prune_dry_run:
+            for relative_path in stale:
+                logger.info(f"[试运行] 将删除 {os.path.join(local_path, relative_path)}")
+            self.__save_json(index_file, sorted(old_index | expected))
+            return f"试运行：将清理 {len(stale)} 个失效文件"
+
+        removed_count = 0
+        for relative_path in stale:
+            file_path = os.path.join(local_path, relative_path)
+            try:
+                os.remove(file_path)
+                removed_count += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"删除 {file_path} 失败：{str(e)}")
+                expected.add(relative_path)
+                continue
+            self.__remove_empty_dirs(os.path.dirname(file_path), local_path)
+        self.__save_json(index_file, sorted(expected))
+        return f"清理失效文件 {removed_count} 个"
+
+    @staticmethod
+    def __remove_empty_dirs(directory: str, local_path: str):
+        """
+        自下而上删除空目录，不删除本地根目录
+        """
+        local_path = os.path.normpath(local_path)
+        directory = os.path.normpath(directory)
+        while directory != local_path and directory.startswith(local_path + os.sep):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+    def _iter_directory(self, path, alist_url, alist_user, alist_password) -> Iterator[dict]:
+        """
+        分页列出目录，每页数据边下载边解析，逐条返回目录条目
+        """
+        page = 1
+        listed = 0
+        while True:
+            payload_list = {
+                "path": path,
+                "password": "",
+                "page": page,
+                "per_page": self._page_size,
+                "refresh": False
+            }
+            header, items = self.__request_api(alist_url, "/api/fs/list", payload_list,
+                                               alist_user, alist_password, stream=True)
+            if header.get('code') != 200:
+                raise Exception(header.get('message'))
+            count = 0
+            for item in items:
+                count += 1
+                yield item
+            listed += count
+            if not self._page_size or self.__last_page(header, count, listed, self._page_size):
+                return
+            page += 1
+
+    @staticmethod
+    def __last_page(header: dict, count: int, listed: int, per_page: int) -> bool:
+        """
+        按total判断是否已取完，服务器单页上限小于per_page时也不会提前结束；没有total时按本页是否取满判断
+        """
+        if not count:
+            return True
+        total = header.get('total')
+        if total is not None:
+            return listed >= total
+        return count < per_page
+
+    def __request_api(self, alist_url, api_path, payload, alist_user, alist_password, stream: bool = False):
+        """
+        携带token请求Alist接口，token失效时重新登录并重放一次请求
+        stream为True时返回 (响应头部, content条目迭代器)
+        """
+        token = self.__get_token(alist_url, alist_password, alist_user)
+        result = self.__post_api(alist_url, api_path, payload, token, stream)
+        header = result[0] if stream else result
+        if header.get('code') == 401:
+            logger.warning(f"{alist_url} token已失效，重新登录：{header.get('message')}")
+            token = self.__get_token(alist_url, alist_password, alist_user, expired_token=token)
+            result = self.__post_api(alist_url, api_path, payload, token, stream)
+        return result
+
+    def __post_api(self, alist_url, api_path, payload, token, stream: bool = False):
+        headers = {
+            'Authorization': token or '',
             'User-Agent': self.UserAgent,
             'Content-Type': 'application/json'
         }
+        response = self.__post_with_limit(alist_url, alist_url + api_path, headers, json.dumps(payload), stream)
+        if response.status_code == 401:
+            response.close()
+            result = {'code': 401, 'message': response.reason}
+            return (result, iter(())) if stream else result
+        if stream:
+            return self.__stream_content(response)
+        return json.loads(response.text)
+
+    def __post_with_limit(self, alist_url, url, headers, data, stream: bool = False) -> requests.Response:
+        """
+        经过限速器发送请求，429、5xx与超时时降速后重试
+        """
+        rate_limiter = self.__get_rate_limiter(alist_url)
+        semaphore = self.__get_semaphore(alist_url)
+        session = self._requests_retry_session(alist_url)
+        error = None
+        for try_number in range(1, self._try_max + 1):
+            rate_limiter.acquire()
+            start = monotonic()
+            try:
+                with semaphore:
+                    response = session.post(url, headers=headers, data=data, stream=stream,
+                                            timeout=self._request_timeout)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                error = e
+                rate_limiter.on_throttle()
+            else:
+                if response.status_code != 429 and response.status_code < 500:
+                    rate_limiter.on_success(monotonic() - start)
+                    return response
+                error = Exception(f"HTTP {response.status_code}")
+                retry_after = response.headers.get('Retry-After')
+                rate_limiter.on_throttle(float(retry_after) if retry_after and retry_after.isdigit() else 0)
+                response.close()
+            logger.warning(f"请求 {url} 第{try_number}次失败：{str(error)}，"
+                           f"降速至 {rate_limiter.rate:.1f} 次/秒后重试")
+        raise error
+
+    def __get_rate_limiter(self, alist_url) -> AdaptiveRateLimiter:
+        """
+        每个Alist主机共用一个限速器
+        """
+        host = urllib.parse.urlparse(alist_url).netloc
+        with self._session_lock:
+            rate_limiter = self._rate_limiters.get(host)
+            if not rate_limiter:
+                rate_limiter = AdaptiveRateLimiter(self._min_rate, self._max_rate)
+                self._rate_limiters[host] = rate_limiter
+            return rate_limiter
+
+    def __get_semaphore(self, alist_url) -> threading.BoundedSemaphore:
+        """
+        每个Alist主机的并发请求共用一个上限，慢服务器不占用其他服务器的名额
+        """
+        host = urllib.parse.urlparse(alist_url).netloc
+        with self._session_lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self._crawl_inflight)
+            return self._semaphores[host]
+
+    @staticmethod
+    def __stream_content(response) -> Tuple[dict, Iterator[dict]]:
+        """
+        增量解析响应流，先返回content之前的状态信息，content数组中的条目在迭代时逐个解码
+        content之后的total在条目迭代完后写入返回的头部
+        """
+        chunks = response.iter_content(chunk_size=64 * 1024)
+        text_decoder = codecs.getincrementaldecoder('utf-8')()
+        buffer = ''
+        index = -1
+        for chunk in chunks:
+            buffer += text_decoder.decode(chunk)
+            index = buffer.find('"content":')
+            if index >= 0:
+                break
+        if index < 0:
+            # 没有content字段（如错误信息），响应已读完，直接整体解析
+            buffer += text_decoder.decode(b'', final=True)
+            response.close()
+            return json.loads(buffer), iter(())
+
+        code = re.search(r'"code":\s*(\d+)', buffer[:index])
+        message = re.search(r'"message":\s*"((?:[^"\\]|\\.)*)"', buffer[:index])
+        total = re.search(r'"total":\s*(\d+)', buffer[:index])
+        header = {
+            'code': int(code.group(1)) if code else None,
+            'message': message.group(1) if message else '',
+            'total': int(total.group(1)) if total else None
+        }
+
+        def iter_items(buffer: str):
+            decoder = json.JSONDecoder()
+            position = index + len('"content":')
+            try:
+                while True:
+                    # 跳过空白与分隔符，数据不足时继续读取
+                    while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                        position += 1
+                    if position < len(buffer):
+                        if buffer[position] == ']' or buffer.startswith('null', position):
+                            # 数组之后只剩少量字段，读完后取出total
+                            tail = buffer[position:] + ''.join(text_decoder.decode(chunk) for chunk in chunks)
+                            total = re.search(r'"total":\s*(\d+)', tail)
+                            if total:
+                                header['total'] = int(total.group(1))
+                            return
+                        if buffer[position] == '[':
+                            position += 1
+                            continue
+                        try:
+                            item, end = decoder.raw_decode(buffer, position)
+                        except json.JSONDecodeError:
+                            pass
+                        else:
+                            yield item
+                            buffer = buffer[end:]
+                            position = 0
+                            continue
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        raise Exception("响应数据不完整")
+                    buffer += text_decoder.decode(chunk)
+            finally:
+                response.close()
+
+        return header, iter_items(buffer)
+
+    def _requests_retry_session(self, alist_url, retries=3, backoff_factor=0.3, status_forcelist=()):
+        """
+        获取Alist服务器对应的会话，整个扫描过程复用同一个连接池
+        """
+        with self._session_lock:
+            session = self._sessions.get(alist_url)
+            if session:
+                return session
+            session = requests.Session()
+            # 读超时与5xx交给限速器处理，这里只重试建立连接
+            retry = Retry(
+                total=retries,
+                read=0,
+                connect=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=status_forcelist,
+            )
+            pool_size = max(self._crawl_workers, self._crawl_inflight)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'Connection': 'keep-alive'})
+            self._sessions[alist_url] = session
+            return session
+
+    def __close_sessions(self):
+        with self._session_lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._rate_limiters.clear()
+            self._semaphores.clear()
+
+    @staticmethod
+    def __to_int(value: Any, default: int, minimum: int = 1) -> int:
         try:
-            response_list = self._requests_retry_session().post(url_list, headers=headers_list, data=payload_list)
-            return json.loads(response_list.text)
-
-        except Exception as x:
-            print(f"Error encountered: {x.__class__.__name__}")
-            print("Retrying...")
-            sleep(5)
-            response_list = self._requests_retry_session().post(url_list, headers=headers_list, data=payload_list)
-            return json.loads(response_list.text)
-
-    def _create_strm_files(self, traversed_paths, root_path, alist_url, token):
-        base_url = alist_url + '/d' + root_path + '/'
-        for path in traversed_paths:
-            json_structure = {}
-            self.__traverse_directory_recursively(path, json_structure, [], alist_url, token)
-            self.__create_strm_files(json_structure, path, base_url, alist_url, root_path)
-
-    def __create_strm_files(self, json_structure, current_path, base_url, alist_url, root_path):
-        target_directory = os.path.join(os.getcwd(), 'strms')
-        for name, item in json_structure.items():
-            if isinstance(item, dict) and item.get('type') == 'file' and name.endswith(self._video_formats):
-                strm_filename = name.rsplit('.', 1)[0] + '.strm'
-                strm_path = os.path.join(target_directory, current_path, strm_filename)
-
-                # 对整个文件路径进行URL编码
-                encoded_file_path = urllib.parse.quote(os.path.join(current_path.replace('\\', '/'), name))
-
-                # 拼接完整的视频URL
-                video_url = base_url + encoded_file_path
-
-                with open(strm_path, 'w', encoding='utf-8') as strm_file:
-                    strm_file.write(video_url)
-            elif isinstance(item, dict):  # 如果是一个目录，递归处理
-                new_directory = os.path.join(target_directory, current_path, name)
-                os.makedirs(new_directory, exist_ok=True)
-                self.__create_strm_files(item, os.path.join(current_path, name), base_url, alist_url, root_path)
-
-    def _requests_retry_session(self, retries=3, backoff_factor=0.3, status_forcelist=(500, 502, 504), session=None):
-        session = session or requests.Session()
-        retry = Retry(
-            total=retries,
-            read=retries,
-            connect=retries,
-            backoff_factor=backoff_factor,
-            status_forcelist=status_forcelist,
-        )
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
-        return session
+            return max(int(value), minimum)
+        except (TypeError, ValueError):
+            return default
 
 
     def __update_config(self):
@@ -258,8 +1084,21 @@ class AlistStrm(_PluginBase):
             "enabled": self._enabled,
             "cron": self._cron,
             "onlyonce": self._onlyonce,
+            "full_scan": self._full_scan,
             "download_subtitle": self._download_subtitle,
-            "liststrm_confs": self._liststrm_confs
+            "scan_concurrency": self._scan_concurrency,
+            "crawl_workers": self._crawl_workers,
+            "crawl_inflight": self._crawl_inflight,
+            "page_size": self._page_size,
+            "use_search": self._use_search,
+            "index_max_age": self._index_max_age,
+            "subtitle_workers": self._subtitle_workers,
+            "prune": self._prune,
+            "prune_dry_run": self._prune_dry_run,
+            "prune_threshold": self._prune_threshold,
+            "min_rate": self._min_rate,
+            "max_rate": self._max_rate,
+            "liststrm_confs": "\n".join(self._liststrm_confs or [])
         })
 
     def get_state(self) -> bool:
@@ -303,7 +1142,7 @@ class AlistStrm(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 4
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -319,7 +1158,7 @@ class AlistStrm(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 4
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -335,7 +1174,23 @@ class AlistStrm(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 4
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'full_scan',
+                                            'label': '全量扫描一次',
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -356,7 +1211,7 @@ class AlistStrm(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 6
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -368,6 +1223,222 @@ class AlistStrm(_PluginBase):
                                         }
                                     }
                                 ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'crawl_workers',
+                                            'label': '遍历线程数',
+                                            'placeholder': '4'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'crawl_inflight',
+                                            'label': '单服务器最大并发请求数',
+                                            'placeholder': '8'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'page_size',
+                                            'label': '列表分页大小',
+                                            'placeholder': '1000，0为不分页'
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'use_search',
+                                            'label': '使用索引搜索',
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'index_max_age',
+                                            'label': '索引有效期（小时）',
+                                            'placeholder': '24'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'subtitle_workers',
+                                            'label': '字幕下载线程数',
+                                            'placeholder': '4'
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'min_rate',
+                                            'label': '最低请求速率（次/秒）',
+                                            'placeholder': '1'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'max_rate',
+                                            'label': '最高请求速率（次/秒）',
+                                            'placeholder': '50'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'scan_concurrency',
+                                            'label': '同时处理配置数',
+                                            'placeholder': '2'
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'prune',
+                                            'label': '清理失效文件',
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'prune_dry_run',
+                                            'label': '清理试运行',
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'prune_threshold',
+                                            'label': '清理安全阈值（%）',
+                                            'placeholder': '20'
+                                        }
+                                    }
+                                ]
                             }
                         ]
                     },
@@ -392,6 +1463,33 @@ class AlistStrm(_PluginBase):
                                 ]
                             }
                         ]
+                    },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VAlert',
+                                        'props': {
+                                            'type': 'info',
+                                            'variant': 'tonal',
+                                            'text': '默认增量扫描，修改时间未变化的目录不再列出；' + '\n' +
+                                                    '本地strm文件被删除或需要重建时，请开启全量扫描一次并立即运行。' + '\n' +
+                                                    '使用索引搜索需要Alist开启索引，索引不可用或过期时自动改为遍历目录。' + '\n' +
+                                                    '字幕只在所在目录被列出时下载，首次开启下载字幕时建议全量扫描一次。' + '\n' +
+                                                    '清理失效文件只处理插件生成过的文件，待删除比例超过安全阈值或有目录获取失败时不会清理；' +
+                                                    '试运行只在日志中列出将要删除的文件。',
+                                            'style': 'white-space: pre-line;'
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
                     }
                 ]
             }
@@ -399,7 +1497,20 @@ class AlistStrm(_PluginBase):
             "enabled": False,
             "cron": "",
             "onlyonce": False,
+            "full_scan": False,
             "download_subtitle": False,
+            "scan_concurrency": 2,
+            "crawl_workers": 4,
+            "crawl_inflight": 8,
+            "page_size": 1000,
+            "use_search": False,
+            "index_max_age": 24,
+            "subtitle_workers": 4,
+            "prune": False,
+            "prune_dry_run": True,
+            "prune_threshold": 20,
+            "min_rate": 1,
+            "max_rate": 50,
             "liststrm_confs": ""
         }
 
@@ -411,7 +1522,11 @@ class AlistStrm(_PluginBase):
             if self._scheduler:
                 self._scheduler.remove_all_jobs()
                 if self._scheduler.running:
+                    # 通知遍历保存断点后退出
+                    self._event.set()
                     self._scheduler.shutdown()
+                    self._event.clear()
                 self._scheduler = None
         except Exception as e:
             logger.error(f"Exiting plugin failed: {str(e)}")
+        self.__close_sessions()
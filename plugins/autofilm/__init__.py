@@ -1,12 +1,34 @@
+import base64
+import hashlib
+import json
 import os
+import random
+import shutil
+import sys
+import threading
+import zlib
+from array import array
+from collections import deque, Counter
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+from xml.etree import ElementTree
+
+from requests import HTTPError, ConnectionError as RequestsConnectionError, Timeout
+from requests.exceptions import ChunkedEncodingError
+from requests.adapters import HTTPAdapter
 from webdav3.client import Client
+from webdav3.exceptions import (ConnectionException, MethodNotSupported, NoConnection, RemoteResourceNotFound,
+                                ResponseErrorCode)
+from webdav3.urn import Urn
 import time
-import requests
 import urllib.parse
 
 import pytz
-from typing import Any, List, Dict, Tuple, Optional
+from typing import Any, List, Dict, Tuple, Optional, Iterator, Callable
 
 from app.core.event import eventmanager, Event
 from app.schemas.types import EventType
@@ -18,6 +40,239 @@ from app.plugins import _PluginBase
 from app.core.config import settings
 
 
+class CircuitOpenError(Exception):
+    """
+    服务器已熔断，请求未发出
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    按服务器熔断：连续失败达到阈值后打开，冷却期内请求直接失败；
+    冷却结束后放行一个探测请求，成功则恢复，失败则重新计时
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self._reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def release_probe(self):
+        """
+        探测请求因本地错误失败，无法判断服务器状态：放弃本次探测，下次请求重新探测
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> bool:
+        """
+        记录一次失败，返回熔断器是否因此打开
+        """
+        with self._lock:
+            self._failures += 1
+            if not self._probing and (self._opened_at is not None or self._failures < self._failure_threshold):
+                return False
+            opened = self._opened_at is None or self._probing
+            self._opened_at = time.monotonic()
+            self._probing = False
+            return opened
+
+
+class PathStore:
+    """
+    紧凑的远端清单：目录驻留为整数id，只保存父目录id、名称与版本标识；
+    每个目录的文件名以\\0拼接成一个字符串，文件版本标识只保存8字节摘要，完整路径按需拼出
+    """
+    ROOT = 0
+
+    def __init__(self):
+        self._parents = array("l", [-1])
+        self._names = [""]
+        self._tags: List[Optional[str]] = [None]
+        self._children: List[Optional[Dict[str, int]]] = [None]
+        self._file_names = [b""]
+        self._file_digests = [b""]
+        # 目录是否已列出，未列出的目录只知道名称与版本标识
+        self._listed = bytearray(1)
+        # 深度遍历时逐个加入的文件，pack时合并
+        self._pending: Dict[int, List[Tuple[str, int]]] = {}
+
+    @staticmethod
+    def digest(tag: Optional[str]) -> int:
+        """
+        版本标识的8字节摘要，0表示没有版本标识
+        """
+        if not tag:
+            return 0
+        return int.from_bytes(hashlib.blake2b(tag.encode(), digest_size=8).digest(), "big") or 1
+
+    @property
+    def listed_count(self) -> int:
+        return self._listed.count(1)
+
+    def path(self, dir_id: int) -> str:
+        """
+        拼出目录相对根目录的路径，以/结尾，根目录为空字符串
+        """
+        names = []
+        while dir_id > self.ROOT:
+            names.append(self._names[dir_id])
+            dir_id = self._parents[dir_id]
+        return "".join(reversed(names))
+
+    def tag(self, dir_id: int) -> Optional[str]:
+        return self._tags[dir_id]
+
+    def is_listed(self, dir_id: Optional[int]) -> bool:
+        return dir_id is not None and bool(self._listed[dir_id])
+
+    def child(self, dir_id: Optional[int], name: str) -> Optional[int]:
+        if dir_id is None or not self._children[dir_id]:
+            return None
+        return self._children[dir_id].get(name)
+
+    def subdirs(self, dir_id: int) -> List[Tuple[str, int]]:
+        return list((self._children[dir_id] or {}).items())
+
+    def resolve(self, dir_path: str, create: bool = False) -> Optional[int]:
+        """
+        按路径查找目录id，create为True时补齐不存在的各级目录
+        """
+        dir_id = self.ROOT
+        for part in filter(None, dir_path.split("/")):
+            child_id = self.child(dir_id, part + "/")
+            if child_id is None:
+                if not create:
+                    return None
+                child_id = self.add_dir(dir_id, part + "/", None)
+            dir_id = child_id
+        return dir_id
+
+    def add_dir(self, parent_id: int, name: str, tag: Optional[str]) -> int:
+        """
+        加入子目录，已存在时更新版本标识
+        """
+        dir_id = self.child(parent_id, name)
+        if dir_id is not None:
+            self._tags[dir_id] = tag
+            return dir_id
+        dir_id = len(self._names)
+        self._parents.append(parent_id)
+        self._names.append(sys.intern(name))
+        self._tags.append(tag)
+        self._children.append(None)
+        self._file_names.append(b"")
+        self._file_digests.append(b"")
+        self._listed.append(0)
+        if self._children[parent_id] is None:
+            self._children[parent_id] = {}
+        self._children[parent_id][name] = dir_id
+        return dir_id
+
+    def set_listed(self, dir_id: int, listed: bool = True):
+        self._listed[dir_id] = int(listed)
+
+    def set_files(self, dir_id: int, files: List[Tuple[str, int]]):
+        """
+        写入目录下全部文件的名称与摘要，并标记目录已列出
+        """
+        self._file_names[dir_id] = zlib.compress("\0".join(name for name, _ in files).encode(), 1)
+        self._file_digests[dir_id] = array("Q", (digest for _, digest in files)).tobytes()
+        self._listed[dir_id] = 1
+
+    def add_file(self, dir_id: int, name: str, digest: int):
+        self._pending.setdefault(dir_id, []).append((name, digest))
+
+    def pack(self):
+        """
+        把逐个加入的文件合并进各目录的紧凑存储
+        """
+        for dir_id, files in self._pending.items():
+            self.set_files(dir_id, list(self.files(dir_id).items()) + files)
+        self._pending.clear()
+
+    def files(self, dir_id: Optional[int]) -> Dict[str, int]:
+        """
+        目录下文件名到摘要的映射，按需展开
+        """
+        if dir_id is None or not self._file_names[dir_id]:
+            return {}
+        digests = array("Q")
+        digests.frombytes(self._file_digests[dir_id])
+        return dict(zip(zlib.decompress(self._file_names[dir_id]).decode().split("\0"), digests))
+
+    def remove_file(self, dir_id: int, name: str):
+        files = self.files(dir_id)
+        if files.pop(name, None) is not None:
+            self.set_files(dir_id, list(files.items()))
+
+    def copy_listing(self, other: "PathStore", other_id: int, dir_id: int):
+        """
+        沿用另一份清单中该目录的文件与子目录，返回其中仍需列出的子目录(本清单id, 另一清单id)
+        """
+        self._file_names[dir_id] = other._file_names[other_id]
+        self._file_digests[dir_id] = other._file_digests[other_id]
+        self._listed[dir_id] = 1
+        return [(self.add_dir(dir_id, name, other.tag(child_id)), child_id)
+                for name, child_id in other.subdirs(other_id)]
+
+    def to_json(self) -> dict:
+        return {
+            "version": 2,
+            "parents": self._parents.tolist(),
+            "names": self._names,
+            "tags": self._tags,
+            "listed": list(self._listed),
+            "file_names": [base64.b64encode(names).decode() for names in self._file_names],
+            "file_digests": [base64.b64encode(digests).decode() for digests in self._file_digests],
+        }
+
+    @classmethod
+    def from_json(cls, data: Optional[dict]) -> "PathStore":
+        """
+        从清单文件恢复，格式不符时返回空清单
+        """
+        store = cls()
+        if not isinstance(data, dict) or data.get("version") != 2:
+            return store
+        store._parents = array("l", data["parents"])
+        store._names = [sys.intern(name) for name in data["names"]]
+        store._tags = data["tags"]
+        store._listed = bytearray(data["listed"])
+        store._file_names = [base64.b64decode(names) for names in data["file_names"]]
+        store._file_digests = [base64.b64decode(digests) for digests in data["file_digests"]]
+        store._children = [None] * len(store._names)
+        for dir_id in range(1, len(store._names)):
+            parent_id = store._parents[dir_id]
+            if store._children[parent_id] is None:
+                store._children[parent_id] = {}
+            store._children[parent_id][store._names[dir_id]] = dir_id
+        return store
+
+
 class AutoFilm(_PluginBase):
     # 插件名称
     plugin_name = "AutoFilm—MoviePilot插件版"
@@ -26,7 +281,7 @@ class AutoFilm(_PluginBase):
     # 插件图标
     plugin_icon = "https://raw.githubusercontent.com/thsrite/MoviePilot-Plugins/main/icons/create.png"
     # 插件版本
-    plugin_version = "1.0"
+    plugin_version = "2.0"
     # 插件作者
     plugin_author = "AceCandy"
     # 作者主页
@@ -43,11 +298,36 @@ class AutoFilm(_PluginBase):
     _cron = None
     _monitor_confs = None
     _onlyonce = False
+    _full_scan = False
     _download_subtitle = False
 
     _autofilm_confs = None
 
     _try_max = 15
+    # 指数退避：首次等待上限、单次等待上限与单个请求的总耗时上限（秒）
+    _retry_base = 1
+    _retry_max_delay = 16
+    _retry_deadline = 60
+    # 连续失败该次数后熔断，冷却该秒数后放行探测请求
+    _breaker_threshold = 5
+    _breaker_cooldown = 60
+    _breakers: Dict[str, CircuitBreaker] = {}
+    # 每个Webdav服务复用一个客户端及其连接池
+    _clients: Dict[Tuple[str, str], Client] = {}
+    _client_lock = threading.Lock()
+    _request_timeout = 60
+    # 遍历目录的工作线程数
+    _crawl_workers = 4
+    # 每个服务同时在途的PROPFIND请求上限
+    _crawl_inflight = 8
+    _semaphores: Dict[str, threading.BoundedSemaphore] = {}
+    # 写入strm的线程数及待写入队列长度
+    _write_workers = 4
+    _queue_size = 1000
+    # 字幕下载线程数
+    _subtitle_workers = 4
+    # 使用Depth: infinity的PROPFIND一次取回整棵目录树
+    _deep_propfind = False
 
     _video_formats = ('.mp4', '.avi', '.rmvb', '.wmv', '.mov', '.mkv', '.flv', '.ts', '.webm', '.iso', '.mpg', '.m2ts')
     _subtitle_formats = ('.ass', '.srt', '.ssa', '.sub')
@@ -61,8 +341,14 @@ class AutoFilm(_PluginBase):
             self._enabled = config.get("enabled")
             self._cron = config.get("cron")
             self._onlyonce = config.get("onlyonce")
+            self._full_scan = config.get("full_scan")
             self._download_subtitle = config.get("download_subtitle")
             self._autofilm_confs = config.get("autofilm_confs").split("\n")
+            self._crawl_workers = self.__to_int(config.get("crawl_workers"), 4)
+            self._crawl_inflight = self.__to_int(config.get("crawl_inflight"), 8)
+            self._write_workers = self.__to_int(config.get("write_workers"), 4)
+            self._subtitle_workers = self.__to_int(config.get("subtitle_workers"), 4)
+            self._deep_propfind = config.get("deep_propfind")
 
         # 停止现有任务
         self.stop_service()
@@ -74,11 +360,13 @@ class AutoFilm(_PluginBase):
             # 运行一次定时服务
             if self._onlyonce:
                 logger.info("AutoFilm执行服务启动，立即运行一次")
-                self._scheduler.add_job(func=self.scan, trigger='date',
+                self._scheduler.add_job(func=self.scan, kwargs={"full_scan": self._full_scan}, trigger='date',
                                         run_date=datetime.now(tz=pytz.timezone(settings.TZ)) + timedelta(seconds=3),
                                         name="AutoFilm单次执行")
-                # 关闭一次性开关
+                # 关闭一次性开关 全量扫描
                 self._onlyonce = False
+                self._full_scan = False
+                self.__update_config()
 
             # 周期运行
             if self._cron:
@@ -97,7 +385,7 @@ class AutoFilm(_PluginBase):
                 self._scheduler.start()
 
     @eventmanager.register(EventType.PluginAction)
-    def scan(self, event: Event = None):
+    def scan(self, event: Event = None, full_scan: bool = False):
         """
         扫描
         """
@@ -117,24 +405,25 @@ class AutoFilm(_PluginBase):
                               title="AutoFilm开始生成strm ...",
                               userid=event.event_data.get("user"))
 
-        logger.info("AutoFilm生成Strm任务开始")
+        logger.info(f"AutoFilm生成Strm任务开始，{'全量' if full_scan else '增量'}扫描")
         
         # 生成strm文件
         for autofilm_conf in self._autofilm_confs:
-            # 格式 Webdav服务器地址:账号:密码:本地目录
+            # 格式 Webdav服务器地址:账号:密码:本地目录[:挂载目录]
             if not autofilm_conf:
                 continue
-            if str(autofilm_conf).count("#") == 3:
+            if str(autofilm_conf).count("#") in (3, 4):
                 webdav_url = str(autofilm_conf).split("#")[0]
                 webdav_account = str(autofilm_conf).split("#")[1]
                 webdav_password = str(autofilm_conf).split("#")[2]
                 local_path = str(autofilm_conf).split("#")[3]
+                mount_path = str(autofilm_conf).split("#")[4] if str(autofilm_conf).count("#") == 4 else None
             else:
                 logger.error(f"{autofilm_conf} 格式错误")
                 continue
 
             # 生成strm文件
-            self.__generate_strm(webdav_url, webdav_account, webdav_password, local_path)
+            self.__generate_strm(webdav_url, webdav_account, webdav_password, local_path, full_scan, mount_path)
 
         logger.info("云盘strm生成任务完成")
         if event:
@@ -142,65 +431,518 @@ class AutoFilm(_PluginBase):
                               title="云盘strm生成任务完成！",
                               userid=event.event_data.get("user"))
 
-    def __generate_strm(self, webdav_url:str, webdav_account:str, webdav_password:str, local_path:str):
+    def __generate_strm(self, webdav_url:str, webdav_account:str, webdav_password:str, local_path:str,
+                        full_scan: bool = False, mount_path: str = None) -> Counter:
         """
-        生成Strm文件
+        生成Strm文件：遍历线程把新增或变化的文件放入有界队列，写入线程边遍历边生成；
+        配置了挂载目录时直接遍历本地挂载，生成的strm内容与Webdav方式相同
+        返回本次处理结果计数：strm/subtitle/skipped/failed
         """
-        dir_url_list = []
-        files_list = []
-        dir_url_list.append(webdav_url)
+        client = self.__get_client(webdav_url, webdav_account, webdav_password)
+        base_url = webdav_url.rstrip("/") + "/"
+        manifest_file = self.__manifest_file(base_url, webdav_account, local_path, mount_path)
+        old_manifest = PathStore() if full_scan else PathStore.from_json(self.__load_json(manifest_file))
+        new_manifest = PathStore()
+        failed_files = []
+        strm_queue = Queue(maxsize=self._queue_size)
+        subtitle_queue = Queue(maxsize=self._queue_size)
 
-        # 获取目录下所有文件
-        while dir_url_list:
-            url = dir_url_list.pop(0)
-            # 连接该Webdav服务器
-            client = Client(options={"webdav_hostname": url,"webdav_login": webdav_account,"webdav_password": webdav_password})
-            try_number = 1
-            while try_number <= self._try_max:
-                try:
-                    items = client.list()
-                except Exception as e:
-                    logger.warning(f"AutoFilm连接{url}遇到错误，第{try_number}尝试失败；错误信息：{str(e)}，传入URL：{url}")
-                    time.sleep(try_number)
-                    try_number += 1
-                else:
-                    if try_number > 1:
-                        logger.info(f"{url}重连成功")
-                    break
-            for item in items[1:]:
-                if item.endswith("/"):
-                    dir_url_list.append(url + item)
+        def on_file(rel_path: str, item: dict):
+            """
+            视频交给strm写入线程，字幕交给字幕下载线程，其他文件忽略
+            """
+            if rel_path.lower().endswith(self._video_formats):
+                strm_queue.put((rel_path, item))
+            elif self._download_subtitle and rel_path.lower().endswith(self._subtitle_formats):
+                subtitle_queue.put((rel_path, item))
+
+        worker_count = self._write_workers + self._subtitle_workers
+        with ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="autofilm-writer") as workers:
+            strm_futures = [workers.submit(self.__queue_worker, strm_queue, failed_files,
+                                           lambda rel_path, item: self.__write_strm(base_url, rel_path, local_path))
+                            for _ in range(self._write_workers)]
+            if mount_path:
+                def save_subtitle(rel_path: str, item: dict) -> str:
+                    return self.__save_subtitle(rel_path, item, local_path, lambda tmp_file: shutil.copyfile(
+                        os.path.join(mount_path, rel_path), tmp_file))
+            else:
+                def save_subtitle(rel_path: str, item: dict) -> str:
+                    return self.__save_subtitle(rel_path, item, local_path, lambda tmp_file: self.__download(
+                        client, base_url, (base_url + rel_path).replace("/dav", "/d"), tmp_file))
+            subtitle_futures = [workers.submit(self.__queue_worker, subtitle_queue, failed_files, save_subtitle)
+                                for _ in range(self._subtitle_workers)]
+            try:
+                if mount_path:
+                    self.__crawl(base_url, old_manifest, new_manifest, on_file,
+                                 lambda dir_path: self.__list_mount(mount_path, dir_path))
+                # 优先用Depth: infinity一次取回整棵目录树，服务端拒绝时逐目录遍历
+                elif not (self._deep_propfind
+                          and self.__deep_crawl(client, base_url, old_manifest, new_manifest, on_file)):
+                    new_manifest = PathStore()
+                    self.__crawl(base_url, old_manifest, new_manifest, on_file,
+                                 lambda dir_path: self.__list_with_retry(client, base_url, dir_path))
+            finally:
+                for _ in strm_futures:
+                    strm_queue.put(None)
+                for _ in subtitle_futures:
+                    subtitle_queue.put(None)
+            stats = sum((future.result() for future in strm_futures + subtitle_futures), Counter())
+        # 根目录都未能列出时保留原清单，避免一次故障导致下次全量重扫
+        save_manifest = new_manifest.is_listed(PathStore.ROOT)
+        # 处理失败的文件不记入清单，所在目录标记为未列出，下次扫描重新列出该目录并重试这些文件
+        for rel_path in failed_files:
+            dir_path, _, name = rel_path.rpartition("/")
+            dir_id = new_manifest.resolve(dir_path)
+            if dir_id is not None:
+                new_manifest.remove_file(dir_id, name)
+                new_manifest.set_listed(dir_id, False)
+        if save_manifest:
+            self.__save_json(manifest_file, new_manifest.to_json())
+        logger.info(f"AutoFilm {base_url} 生成strm文件{stats['strm']}个，下载字幕{stats['subtitle']}个，"
+                    f"跳过未变化字幕{stats['skipped']}个，失败{stats['failed']}个")
+        return stats
+
+    @staticmethod
+    def __queue_worker(file_queue: Queue, failed_files: List[str],
+                       handler: Callable[[str, dict], str]) -> Counter:
+        """
+        工作线程：从队列取文件逐个处理，收到None时退出，返回各处理结果的计数
+        """
+        stats = Counter()
+        while True:
+            task = file_queue.get()
+            if task is None:
+                return stats
+            rel_path, item = task
+            try:
+                result = handler(rel_path, item)
+            except Exception as e:
+                logger.error(f"AutoFilm处理{rel_path}失败：{str(e)}")
+                result = "failed"
+            if result == "failed":
+                failed_files.append(rel_path)
+            stats[result] += 1
+
+    def __crawl(self, base_url: str, old_manifest: PathStore, new_manifest: PathStore,
+                on_file: Callable[[str, dict], None], list_directory: Callable[[str], Optional[List[dict]]]):
+        """
+        广度优先并发遍历，待遍历目录放在双端队列中，每个目录列出后立即交出其中新增或变化的文件
+        """
+        # 待遍历目录记为(本次清单id, 上次清单id)，路径在发出请求时才拼出
+        frontier = deque([(PathStore.ROOT, PathStore.ROOT)])
+        file_count = 0
+        unchanged_count = 0
+        listed_count = 0
+        with ThreadPoolExecutor(max_workers=self._crawl_workers, thread_name_prefix="autofilm") as executor:
+            pending = {}
+            while frontier or pending:
+                while frontier and len(pending) < self._crawl_workers * 2:
+                    dir_id, old_id = frontier.popleft()
+                    dir_path = new_manifest.path(dir_id)
+                    future = executor.submit(list_directory, dir_path)
+                    pending[future] = (dir_id, old_id, dir_path)
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dir_id, old_id, dir_path = pending.pop(future)
+                    items = future.result()
+                    if items is None:
+                        continue
+                    listed_count += 1
+                    # 未列出的目录可能是上次有文件处理失败，已处理成功的文件仍按清单跳过
+                    old_files = old_manifest.files(old_id)
+                    files = []
+                    for item in items:
+                        item_tag = self.__entry_tag(item)
+                        if item["is_dir"]:
+                            child_id = new_manifest.add_dir(dir_id, item["name"], item_tag)
+                            self.__schedule_directory(child_id, old_manifest.child(old_id, item["name"]),
+                                                      old_manifest, new_manifest, frontier)
+                            continue
+                        digest = PathStore.digest(item_tag)
+                        files.append((item["name"], digest))
+                        file_count += 1
+                        if digest and old_files.get(item["name"]) == digest:
+                            unchanged_count += 1
+                        else:
+                            on_file(dir_path + item["name"], item)
+                    new_manifest.set_files(dir_id, files)
+        logger.info(f"AutoFilm遍历{base_url}完成，列出{listed_count}个目录，"
+                    f"跳过{new_manifest.listed_count - listed_count}个未变化目录，"
+                    f"获取到{file_count}个文件，其中{unchanged_count}个未变化")
+
+    @staticmethod
+    def __schedule_directory(dir_id: int, old_id: Optional[int], old_manifest: PathStore, new_manifest: PathStore,
+                             frontier: deque):
+        """
+        目录版本与清单一致时沿用清单中的整棵子树，否则加入待遍历队列
+        """
+        stack = [(dir_id, old_id)]
+        while stack:
+            dir_id, old_id = stack.pop()
+            tag = new_manifest.tag(dir_id)
+            if tag and old_manifest.is_listed(old_id) and old_manifest.tag(old_id) == tag:
+                stack.extend(new_manifest.copy_listing(old_manifest, old_id, dir_id))
+            else:
+                frontier.append((dir_id, old_id))
+
+    def __deep_crawl(self, client: Client, base_url: str, old_manifest: PathStore, new_manifest: PathStore,
+                     on_file: Callable[[str, dict], None]) -> bool:
+        """
+        深度遍历：边下载边解析Depth: infinity的响应，解析到新增或变化的文件立即交出，失败返回False
+        """
+        file_count = 0
+        unchanged_count = 0
+        # 响应中同一目录的条目通常相邻，缓存最近一个目录的查找结果
+        last_dir = (None, None, {})
+        try:
+            for item in self.__deep_listing(client, base_url):
+                item_tag = self.__entry_tag(item)
+                dir_path, _, name = item["name"].rstrip("/").rpartition("/")
+                if last_dir[0] != dir_path:
+                    dir_id = new_manifest.resolve(dir_path, create=True)
+                    old_id = old_manifest.resolve(dir_path)
+                    last_dir = (dir_path, dir_id, old_manifest.files(old_id))
+                    new_manifest.set_listed(dir_id)
+                _, dir_id, old_files = last_dir
+                if item["is_dir"]:
+                    new_manifest.set_listed(new_manifest.add_dir(dir_id, name + "/", item_tag))
+                    continue
+                digest = PathStore.digest(item_tag)
+                new_manifest.add_file(dir_id, name, digest)
+                file_count += 1
+                if digest and old_files.get(name) == digest:
+                    unchanged_count += 1
                 else:
-                    files_list.append(url + item)
-        
-        logger.info(f"AutoFilm获取到{len(files_list)}个文件，开始生成strm文件")
-
-        for file_url in files_list:
-            if file_url.lower().endswith(tuple(self._video_formats)):
-                strm_file_path = os.path.join(local_path, file_url.replace(webdav_url, '').rsplit(".", 1)[0] + ".strm")
-                os.makedirs(os.path.dirname(strm_file_path), exist_ok=True) # 创建递归目录
-                with open(strm_file_path, "w") as f:
-                    url_string = urllib.parse.unquote(file_url.replace("/dav", "/d"))
-                    f.write(url_string)
-            elif file_url.lower().endswith(tuple(self._subtitle_formats)):
-                try_number = 1
-                while try_number <= self._try_max:
+                    on_file(item["name"], item)
+        except (ResponseErrorCode, MethodNotSupported) as e:
+            logger.warning(f"AutoFilm {base_url} 不支持Depth: infinity，改为逐目录遍历：{str(e)}")
+            return False
+        except Exception as e:
+            logger.warning(f"AutoFilm {base_url} 深度遍历中断，已获取{file_count}个文件，改为逐目录遍历：{str(e)}")
+            return False
+        new_manifest.pack()
+        logger.info(f"AutoFilm深度遍历{base_url}完成，共获取到{file_count}个文件，其中{unchanged_count}个未变化")
+        return True
+
+    @staticmethod
+    def __entry_tag(item: dict) -> Optional[str]:
+        """
+        条目版本标识：优先使用ETag，没有时使用修改时间与大小
+        """
+        if item.get("etag"):
+            return item["etag"]
+        if item.get("modified"):
+            return f"{item['modified']}#{item.get('size') or ''}"
+        return None
+
+    def __deep_listing(self, client: Client, base_url: str) -> Iterator[dict]:
+        """
+        发送Depth: infinity的PROPFIND，流式解析multistatus，逐条返回条目，名称为相对根目录的路径
+        """
+        base_path = unquote(urlsplit(base_url).path)
+        with self.__get_semaphore(base_url):
+            response = client.execute_request(action="list", path=Urn.separate, headers_ext=["Depth: infinity"])
+            try:
+                response.raw.decode_content = True
+                root = None
+                for event, elem in ElementTree.iterparse(response.raw, events=("start", "end")):
+                    if root is None:
+                        root = elem
+                        continue
+                    if event != "end" or elem.tag != "{DAV:}response":
+                        continue
+                    item = self.__parse_response(elem, base_path)
+                    # 已处理的节点及时丢弃，内存不随目录规模增长
+                    root.clear()
+                    if item:
+                        yield item
+            finally:
+                response.close()
+
+    @staticmethod
+    def __write_strm(base_url: str, rel_path: str, local_path: str) -> str:
+        """
+        生成视频对应的strm文件
+        """
+        strm_file_path = os.path.join(local_path, rel_path.rsplit(".", 1)[0] + ".strm")
+        os.makedirs(os.path.dirname(strm_file_path), exist_ok=True) # 创建递归目录
+        with open(strm_file_path, "w") as f:
+            url_string = urllib.parse.unquote((base_url + rel_path).replace("/dav", "/d"))
+            f.write(url_string)
+        return "strm"
+
+    def __save_subtitle(self, rel_path: str, item: dict, local_path: str, fetch: Callable[[Path], None]) -> str:
+        """
+        获取字幕到临时文件后原子替换；本地文件大小与修改时间与远端一致时跳过
+        """
+        subtitle_file = Path(local_path) / rel_path
+        remote_size = int(item["size"]) if str(item.get("size") or "").isdigit() else None
+        remote_mtime = self.__parse_http_date(item.get("modified"))
+        if subtitle_file.exists() and remote_size is not None and remote_mtime is not None:
+            stat = subtitle_file.stat()
+            if stat.st_size == remote_size and int(stat.st_mtime) == int(remote_mtime):
+                return "skipped"
+
+        subtitle_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = subtitle_file.with_name(f"{subtitle_file.name}.tmp")
+        try:
+            fetch(tmp_file)
+        except Exception as e:
+            if tmp_file.exists():
+                tmp_file.unlink()
+            logger.error(f"AutoFilm获取字幕{rel_path}失败，已跳过：{str(e)}")
+            return "failed"
+        os.replace(tmp_file, subtitle_file)
+        # 本地修改时间与远端保持一致，供下次扫描比较
+        if remote_mtime is not None:
+            os.utime(subtitle_file, (remote_mtime, remote_mtime))
+        return "subtitle"
+
+    def __download(self, client: Client, base_url: str, file_url: str, tmp_file: Path):
+        """
+        分块下载文件，失败按退避策略重试
+        """
+        def download():
+            with client.session.get(file_url, stream=True, timeout=self._request_timeout) as response:
+                response.raise_for_status()
+                with open(tmp_file, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+
+        self.__call_with_retry(base_url, file_url, download)
+
+    @staticmethod
+    def __parse_http_date(value: Optional[str]) -> Optional[float]:
+        if not value:
+            return None
+        try:
+            return parsedate_to_datetime(value).timestamp()
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def __list_mount(mount_path: str, dir_path: str) -> Optional[List[dict]]:
+        """
+        用os.scandir列出本地挂载目录，条目格式与PROPFIND解析结果一致
+        """
+        items = []
+        try:
+            with os.scandir(os.path.join(mount_path, dir_path)) as entries:
+                for entry in entries:
+                    # 失效的软链接或遍历时被删除的条目只跳过该条目，不影响整个目录
                     try:
-                        response = requests.get(file_url.replace("/dav", "/d"))
-                    except Exception as e:
-                        logger.warning(f"AutoFilm下载{file_url}遇到错误，第{try_number}尝试失败；错误信息：{str(e)}，传入URL：{file_url}")
-                        time.sleep(try_number)
-                        try_number += 1
+                        is_dir = entry.is_dir()
+                        stat = entry.stat()
+                    except OSError as e:
+                        logger.warning(f"AutoFilm读取挂载条目{entry.path}失败，已跳过：{str(e)}")
+                        continue
+                    items.append({
+                        "name": entry.name + "/" if is_dir else entry.name,
+                        "is_dir": is_dir,
+                        "etag": None,
+                        "modified": formatdate(stat.st_mtime, usegmt=True),
+                        "size": str(stat.st_size),
+                    })
+        except OSError as e:
+            logger.error(f"AutoFilm读取挂载目录{os.path.join(mount_path, dir_path)}失败，已跳过：{str(e)}")
+            return None
+        return items
+
+    def __list_with_retry(self, client: Client, base_url: str, dir_path: str) -> Optional[List[dict]]:
+        """
+        列出目录，失败时重试，重试耗尽或服务器熔断时返回None
+        """
+        url = base_url + dir_path
+        semaphore = self.__get_semaphore(base_url)
+
+        def list_directory():
+            with semaphore:
+                return self.__list_directory(client, dir_path)
+
+        try:
+            return self.__call_with_retry(base_url, url, list_directory)
+        except CircuitOpenError as e:
+            logger.debug(f"AutoFilm跳过目录{url}：{str(e)}")
+        except Exception as e:
+            logger.error(f"AutoFilm获取{url}目录失败，已跳过：{str(e)}")
+        return None
+
+    def __call_with_retry(self, base_url: str, url: str, func: Callable[[], Any]) -> Any:
+        """
+        指数退避加随机抖动重试，单个请求总耗时不超过_retry_deadline；服务器熔断时直接失败
+        """
+        breaker = self.__get_breaker(base_url)
+        deadline = time.monotonic() + self._retry_deadline
+        for try_number in range(1, self._try_max + 1):
+            if not breaker.allow():
+                raise CircuitOpenError(f"{urlsplit(base_url).netloc} 连续请求失败，已熔断")
+            try:
+                result = func()
+            except Exception as e:
+                if not self.__is_retryable(e):
+                    # 服务器有正常响应，只是请求本身有误；本地读写等错误与服务器无关，不计入熔断
+                    if self.__response_code(e) is not None:
+                        breaker.record_success()
                     else:
-                        if try_number > 1:
-                            logger.info(f"{file_url}下载成功")
-                        break
-                    
-                subtitile_file_path = os.path.join(local_path, file_url.replace(webdav_url, ''))
-                os.makedirs(os.path.dirname(subtitile_file_path), exist_ok=True) # 创建递归目录
-                with open(subtitile_file_path, "wb") as f:
-                    f.write(response.content)
-        
+                        breaker.release_probe()
+                    raise
+                if breaker.record_failure():
+                    logger.error(f"AutoFilm {urlsplit(base_url).netloc} 连续{self._breaker_threshold}次请求失败，"
+                                 f"熔断{self._breaker_cooldown}秒")
+                delay = random.uniform(0, min(self._retry_max_delay, self._retry_base * 2 ** (try_number - 1)))
+                if try_number == self._try_max or time.monotonic() + delay > deadline or breaker.is_open:
+                    raise
+                logger.warning(f"AutoFilm请求{url}遇到错误，第{try_number}次尝试失败，{delay:.1f}秒后重试；"
+                               f"错误信息：{str(e)}")
+                time.sleep(delay)
+            else:
+                breaker.record_success()
+                if try_number > 1:
+                    logger.info(f"{url}重连成功")
+                return result
+
+    @classmethod
+    def __is_retryable(cls, err: Exception) -> bool:
+        """
+        只有连接失败、超时与5xx、408、429响应可重试；其余4xx与本地读写错误直接失败
+        """
+        if isinstance(err, (RequestsConnectionError, Timeout, ChunkedEncodingError, NoConnection,
+                            ConnectionException)):
+            return True
+        code = cls.__response_code(err)
+        return code is not None and (code >= 500 or code in (408, 429))
+
+    @staticmethod
+    def __response_code(err: Exception) -> Optional[int]:
+        """
+        服务器返回错误响应时的状态码，其他错误返回None
+        """
+        if isinstance(err, HTTPError) and err.response is not None:
+            return err.response.status_code
+        if isinstance(err, ResponseErrorCode):
+            return err.code
+        if isinstance(err, RemoteResourceNotFound):
+            return 404
+        if isinstance(err, MethodNotSupported):
+            return 405
+        return None
+
+    def __get_breaker(self, base_url: str) -> CircuitBreaker:
+        host = urlsplit(base_url).netloc
+        with self._client_lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self._breaker_threshold, self._breaker_cooldown)
+            return self._breakers[host]
+
+    def __get_semaphore(self, base_url: str) -> threading.BoundedSemaphore:
+        """
+        同一服务器的并发请求共用一个上限
+        """
+        host = urlsplit(base_url).netloc
+        with self._client_lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self._crawl_inflight)
+            return self._semaphores[host]
+
+    def __get_client(self, webdav_url: str, webdav_account: str, webdav_password: str) -> Client:
+        """
+        获取Webdav客户端，同一服务复用同一个会话以保持长连接
+        """
+        key = (webdav_url, webdav_account)
+        with self._client_lock:
+            client = self._clients.get(key)
+            if client and client.webdav.password == webdav_password:
+                return client
+            client = Client(options={
+                "webdav_hostname": webdav_url,
+                "webdav_login": webdav_account,
+                "webdav_password": webdav_password,
+                "webdav_timeout": self._request_timeout,
+            })
+            # 认证信息放在会话上，连接池大小与并发数匹配
+            client.session.auth = (webdav_account, webdav_password)
+            pool_size = max(self._crawl_workers, self._crawl_inflight) + self._subtitle_workers
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            client.session.mount("http://", adapter)
+            client.session.mount("https://", adapter)
+            self._clients[key] = client
+            return client
+
+    def __list_directory(self, client: Client, dir_path: str) -> List[dict]:
+        """
+        列出目录；直接发送PROPFIND，省去client.list对子目录额外的存在性检查
+        """
+        urn = Urn(dir_path, directory=True)
+        response = client.execute_request(action="list", path=urn.quote())
+        base_path = unquote(urlsplit(client.get_url(urn.quote())).path)
+        items = (self.__parse_response(elem, base_path)
+                 for elem in ElementTree.fromstring(response.content).iter("{DAV:}response"))
+        return [item for item in items if item]
+
+    @staticmethod
+    def __parse_response(elem: ElementTree.Element, base_path: str) -> Optional[dict]:
+        """
+        解析multistatus中的单个response，名称为相对base_path的路径，目录以/结尾；base_path自身及其外的条目返回None
+        """
+        href = elem.findtext("{DAV:}href")
+        if not href:
+            return None
+        path = unquote(urlsplit(href).path)
+        if not path.startswith(base_path) or len(path.rstrip("/")) < len(base_path):
+            return None
+        is_dir = elem.find(".//{DAV:}collection") is not None
+        name = path[len(base_path):].rstrip("/")
+        return {
+            "name": name + "/" if is_dir else name,
+            "is_dir": is_dir,
+            "etag": elem.findtext(".//{DAV:}getetag"),
+            "modified": elem.findtext(".//{DAV:}getlastmodified"),
+            "size": elem.findtext(".//{DAV:}getcontentlength"),
+        }
+
+    def __manifest_file(self, base_url: str, webdav_account: str, local_path: str, mount_path: str = None) -> Path:
+        """
+        每条配置对应一份远端清单，记录各目录与文件的ETag或修改时间
+        """
+        conf = f"{base_url}#{webdav_account}#{local_path}" + (f"#{mount_path}" if mount_path else "")
+        conf_key = hashlib.md5(conf.encode()).hexdigest()
+        return self.get_data_path() / "manifest" / f"{conf_key}.json"
+
+    @staticmethod
+    def __load_json(data_file: Path, default: Any = None) -> Any:
+        if not data_file.exists():
+            return default
+        try:
+            return json.loads(data_file.read_text(encoding="utf-8"))
+        except Exception as e:
+            logger.warning(f"读取 {data_file} 失败：{str(e)}")
+            return default
+
+    @staticmethod
+    def __save_json(data_file: Path, data: Any):
+        data_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = data_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_file, data_file)
+
+    def __close_clients(self):
+        """
+        关闭所有Webdav会话
+        """
+        with self._client_lock:
+            for client in self._clients.values():
+                client.session.close()
+            self._clients.clear()
+            self._semaphores.clear()
+            self._breakers.clear()
+
+    @staticmethod
+    def __to_int(value: Any, default: int, minimum: int = 1) -> int:
+        try:
+            return max(int(value), minimum)
+        except (TypeError, ValueError):
+            return default
+
     def __update_config(self):
         """
         更新配置
@@ -208,10 +950,15 @@ class AutoFilm(_PluginBase):
         self.update_config({
             "enabled": self._enabled,
             "onlyonce": self._onlyonce,
-            "rebuild": self._rebuild,
-            "copy_files": self._copy_files,
+            "full_scan": self._full_scan,
             "cron": self._cron,
-            "monitor_confs": self._monitor_confs
+            "download_subtitle": self._download_subtitle,
+            "crawl_workers": self._crawl_workers,
+            "crawl_inflight": self._crawl_inflight,
+            "write_workers": self._write_workers,
+            "subtitle_workers": self._subtitle_workers,
+            "deep_propfind": self._deep_propfind,
+            "autofilm_confs": "\n".join(self._autofilm_confs or [])
         })
 
     def get_state(self) -> bool:
@@ -272,7 +1019,7 @@ class AutoFilm(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 4
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -288,7 +1035,7 @@ class AutoFilm(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 4
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -304,7 +1051,23 @@ class AutoFilm(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 4
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'full_scan',
+                                            'label': '全量扫描一次',
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -315,6 +1078,22 @@ class AutoFilm(_PluginBase):
                                         }
                                     }
                                 ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'deep_propfind',
+                                            'label': '深度遍历',
+                                        }
+                                    }
+                                ]
                             }
                         ]
                     },
@@ -325,7 +1104,7 @@ class AutoFilm(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 6
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -337,6 +1116,74 @@ class AutoFilm(_PluginBase):
                                         }
                                     }
                                 ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'crawl_workers',
+                                            'label': '遍历线程数',
+                                            'placeholder': '4'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'crawl_inflight',
+                                            'label': '最大并发请求数',
+                                            'placeholder': '8'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'write_workers',
+                                            'label': '写入线程数',
+                                            'placeholder': '4'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'subtitle_workers',
+                                            'label': '字幕下载线程数',
+                                            'placeholder': '4'
+                                        }
+                                    }
+                                ]
                             }
                         ]
                     },
@@ -355,7 +1202,33 @@ class AutoFilm(_PluginBase):
                                             'model': 'autofilm_confs',
                                             'label': 'AutoFilm配置文件',
                                             'rows': 5,
-                                            'placeholder': 'Webdav服务器地址#账号#密码#本地目录'
+                                            'placeholder': 'Webdav服务器地址#账号#密码#本地目录#挂载目录(可选)'
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VAlert',
+                                        'props': {
+                                            'type': 'info',
+                                            'variant': 'tonal',
+                                            'text': '默认增量扫描，ETag或修改时间未变化的目录不再列出，未变化的文件不再重新生成；' + '\n' +
+                                                    '本地文件被删除或需要重建时，请开启全量扫描一次并立即运行。' + '\n' +
+                                                    '首次开启下载字幕时建议全量扫描一次，大小与修改时间未变化的字幕不会重复下载。' + '\n' +
+                                                    '已用rclone、CloudDrive2等把同一存储挂载到本地时，可在配置末尾填写挂载目录（对应Webdav根目录），' +
+                                                    '直接遍历本地目录生成strm，字幕从挂载目录复制。',
+                                            'style': 'white-space: pre-line;'
                                         }
                                     }
                                 ]
@@ -368,7 +1241,13 @@ class AutoFilm(_PluginBase):
             "enabled": False,
             "cron": "",
             "onlyonce": False,
-            "download_subttile": False,
+            "full_scan": False,
+            "download_subtitle": False,
+            "crawl_workers": 4,
+            "crawl_inflight": 8,
+            "write_workers": 4,
+            "subtitle_workers": 4,
+            "deep_propfind": False,
             "autofilm_confs": ""
         }
 
@@ -385,5 +1264,6 @@ class AutoFilm(_PluginBase):
                 if self._scheduler.running:
                     self._scheduler.shutdown()
                 self._scheduler = None
+            self.__close_clients()
         except Exception as e:
             logger.error(f"退出插件失败：{str(e)}")
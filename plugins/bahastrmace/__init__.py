@@ -1,5 +1,7 @@
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 from datetime import datetime, timedelta
 from urllib.parse import quote, urljoin
@@ -7,6 +9,8 @@ import xml.dom.minidom
 from typing import Any, List, Dict, Tuple, Optional
 
 import pytz
+import requests
+from requests.adapters import HTTPAdapter
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 
@@ -53,6 +57,30 @@ def retry(ExceptionToCheck: Any,
     return deco_retry
 
 
+class RateLimiter:
+    """
+    全局令牌桶限速，所有列目录线程共享，避免请求过快被ANi镜像限流
+    """
+
+    def __init__(self, rate: float):
+        self._rate = max(rate, 0.1)
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._tokens + (now - self._updated) * self._rate, max(self._rate, 1.0))
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self._rate
+            time.sleep(wait_time)
+
+
 class BahaStrmAce(_PluginBase):
     # 插件名称
     plugin_name = "Ani Strm增强"
@@ -61,7 +89,7 @@ class BahaStrmAce(_PluginBase):
     # 插件图标
     plugin_icon = "https://raw.githubusercontent.com/honue/MoviePilot-Plugins/main/icons/anistrm.png"
     # 插件版本
-    plugin_version = "1.9.4"
+    plugin_version = "1.9.6"
     # 插件作者
     plugin_author = "AceCandy"
     # 作者主页
@@ -80,6 +108,15 @@ class BahaStrmAce(_PluginBase):
     _onlyonce = False
     _fulladd = False
     _storageplace = None
+    # 全量列目录并发数
+    _list_workers = 4
+    # 每秒最大请求数
+    _max_rate = 5
+
+    # 共享连接池
+    _session: Optional[requests.Session] = None
+    _session_lock = threading.Lock()
+    _rate_limiter: Optional[RateLimiter] = None
 
     # 定时器
     _scheduler: Optional[BackgroundScheduler] = None
@@ -94,6 +131,9 @@ class BahaStrmAce(_PluginBase):
             self._onlyonce = config.get("onlyonce")
             self._fulladd = config.get("fulladd")
             self._storageplace = config.get("storageplace")
+            self._list_workers = self.__to_int(config.get("list_workers"), 4)
+            self._max_rate = self.__to_int(config.get("max_rate"), 5)
+        self._rate_limiter = RateLimiter(self._max_rate)
             # 加载模块
         if self._enabled or self._onlyonce:
             # 定时服务
@@ -123,29 +163,59 @@ class BahaStrmAce(_PluginBase):
                 self._scheduler.print_jobs()
                 self._scheduler.start()
 
-    @retry(Exception, tries=3, logger=logger, ret=[])
-    def get_name_list(self, url:str = 'https://ani.v300.eu.org/', folder_name: str = '') -> List[str]:
-        rep = RequestUtils(ua=settings.USER_AGENT if settings.USER_AGENT else None,
-                           proxies=settings.PROXY if settings.PROXY else None).post(url=url)
-        files_json = rep.json()['files']
-        logger.info(f"请求拉取路径: {url}")
+    def get_name_list(self, url: str = 'https://ani.v300.eu.org/', folder_name: str = '') -> List[str]:
+        """
+        并发递归获取目录下所有文件，同级子目录并行请求，整体受全局限速约束
+        """
         result = []
-        for file in files_json:
-            if file['mimeType'] == 'application/vnd.google-apps.folder':
-                result.extend(self.get_name_list(url=f'{url}{quote(file["name"])}/', folder_name=f"{folder_name}/{file['name']}"))
-            else:
-                if not file['name'].endswith('.nfo'):
-                    folder_path = f"{folder_name}/{file['name']}" if folder_name else file['name']
-                    result.append(folder_path)
-                    #logger.debug(f'路径添加进来: {folder_path}')
-
+        with ThreadPoolExecutor(max_workers=max(self._list_workers, 1),
+                                thread_name_prefix="bahastrm-list") as executor:
+            pending = {executor.submit(self.__list_folder, url): (url, folder_name)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    parent_url, parent = pending.pop(future)
+                    files_json = future.result()
+                    if files_json is None:
+                        continue
+                    for file in files_json:
+                        path = f"{parent}/{file['name']}" if parent else file['name']
+                        if file['mimeType'] == 'application/vnd.google-apps.folder':
+                            sub_url = f"{parent_url}{quote(file['name'])}/"
+                            pending[executor.submit(self.__list_folder, sub_url)] = (sub_url, path)
+                        elif not file['name'].endswith('.nfo'):
+                            result.append(path)
         return result
 
+    @retry(Exception, tries=3, logger=logger, ret=None)
+    def __list_folder(self, url: str) -> Optional[List[dict]]:
+        rep = self.__request().post_res(url=url)
+        rep.raise_for_status()
+        logger.info(f"请求拉取路径: {url}")
+        return rep.json()['files']
+
+    def __request(self) -> RequestUtils:
+        """
+        复用共享连接池的请求工具，每次请求前先经过全局限速
+        """
+        if self._rate_limiter:
+            self._rate_limiter.acquire()
+        with self._session_lock:
+            if not self._session:
+                session = requests.Session()
+                pool_size = max(self._list_workers, 1) + 2
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                BahaStrmAce._session = session
+        return RequestUtils(ua=settings.USER_AGENT if settings.USER_AGENT else None,
+                            proxies=settings.PROXY if settings.PROXY else None,
+                            session=self._session)
+
     @retry(Exception, tries=3, logger=logger, ret=[])
     def get_latest_list(self) -> List:
         addr = 'https://aniapi.v300.eu.org/ani-download.xml'
-        ret = RequestUtils(ua=settings.USER_AGENT if settings.USER_AGENT else None,
-                           proxies=settings.PROXY if settings.PROXY else None).get_res(addr)
+        ret = self.__request().get_res(addr)
         ret_xml = ret.text
         # 解析XML
         dom_tree = xml.dom.minidom.parseString(ret_xml)
@@ -166,8 +236,7 @@ class BahaStrmAce(_PluginBase):
             # 下载文件到当前目录
             logger.debug(f'{file_url} 非视频文件直接下载: {src_url}')
             try:
-                request = RequestUtils(ua=settings.USER_AGENT if settings.USER_AGENT else None,
-                                        proxies=settings.PROXY if settings.PROXY else None).get_res(src_url)
+                request = self.__request().get_res(src_url)
                 if request and request.status_code == 200:
                     sub_file = Path(self._storageplace) / file_url
                     sub_file.write_bytes(request.content)
@@ -203,19 +272,17 @@ class BahaStrmAce(_PluginBase):
         # 全量添加当季
         else:
             url = f'https://ani.v300.eu.org/'
-            rep = RequestUtils(ua=settings.USER_AGENT if settings.USER_AGENT else None,
-                               proxies=settings.PROXY if settings.PROXY else None).post(url=url)
+            rep = self.__request().post_res(url=url)
             files_json = rep.json()['files']
             # 获取根目录
             allList = [file['name'] for file in files_json]
             logger.info(f'全量根目录: {allList}')
             for dir_name in allList:
                 cnt = 0
-                for file_name in self.get_name_list(url=f'{url}{dir_name}/', folder_name=dir_name):
+                for file_name in self.get_name_list(url=f'{url}{quote(dir_name)}/', folder_name=dir_name):
                     if self.__touch_strm_file(file_name):
                         cnt += 1
                 logger.warn(f'目录{dir_name}: 全量创建了 {cnt} 个strm文件')
-                time.sleep(2)
 
 
     def get_state(self) -> bool:
@@ -328,6 +395,47 @@ class BahaStrmAce(_PluginBase):
                             }
                         ]
                     },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'list_workers',
+                                            'label': '全量列目录并发数',
+                                            'placeholder': '4',
+                                            'type': 'number'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'max_rate',
+                                            'label': '每秒最大请求数',
+                                            'placeholder': '5',
+                                            'type': 'number'
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    },
                     {
                         'component': 'VRow',
                         'content': [
@@ -369,6 +477,8 @@ class BahaStrmAce(_PluginBase):
             "fulladd": False,
             "storageplace": '/downloads/strm',
             "cron": "*/20 22,23,0,1 * * *",
+            "list_workers": 4,
+            "max_rate": 5,
         }
 
     def __update_config(self):
@@ -378,8 +488,17 @@ class BahaStrmAce(_PluginBase):
             "enabled": self._enabled,
             "fulladd": self._fulladd,
             "storageplace": self._storageplace,
+            "list_workers": self._list_workers,
+            "max_rate": self._max_rate,
         })
 
+    @staticmethod
+    def __to_int(value: Any, default: int) -> int:
+        try:
+            return max(int(value), 1)
+        except (TypeError, ValueError):
+            return default
+
     def get_page(self) -> List[dict]:
         pass
 
@@ -393,6 +512,10 @@ class BahaStrmAce(_PluginBase):
                 if self._scheduler.running:
                     self._scheduler.shutdown()
                 self._scheduler = None
+            with self._session_lock:
+                if self._session:
+                    self._session.close()
+                    BahaStrmAce._session = None
         except Exception as e:
             logger.error("退出插件失败：%s" % str(e))
 